@@ -1,14 +1,21 @@
+import startup  # Import first: startup-time report (FACE_STARTUP_REPORT=1)
 import os.path  # Import os.path module for file and directory operations
-import datetime  # Import datetime module to handle date and time
-import pickle  # Import pickle module for serializing and deserializing objects
-import csv  # Import csv module for CSV file operations
+import threading  # Import threading to load the models in the background
 
 import tkinter as tk  # Import tkinter module for GUI
 import cv2  # Import OpenCV module for computer vision tasks
-from PIL import Image, ImageTk  # Import Image and ImageTk from PIL for image processing
-import face_recognition  # Import face_recognition module for face recognition tasks
 
 import util  # Import custom utility module
+import metrics  # Import the stage timers and counters (enabled with FACE_METRICS=1)
+from gallery import Gallery  # Import the in-memory embedding gallery
+from store import open_store, warn_bgr  # Import the packed on-disk embedding store
+from index import open_index  # Import the optional approximate nearest-neighbour index
+from capture import FrameGrabber  # Import the threaded webcam frame grabber
+from render import PreviewRenderer  # Import the low-overhead preview renderer
+from enrollment import Enrollment, save_templates  # Import multi-sample enrollment
+from workers import RecognitionExecutor  # Import the background recognition worker pool
+from tracking import AttendanceStream  # Import the hands-free detection + tracking loop
+from events import AttendanceStore  # Import the SQLite attendance event store
 # from test import test  # Import test function from test module
 
 
@@ -30,123 +37,188 @@ class App:
                                                                     self.register_new_user, fg='black')
         self.register_new_user_button_main_window.place(x=750, y=400) 
 
+        # Create and place the hands-free mode button (cycles off -> in -> out)
+        self.hands_free_button_main_window = util.get_button(self.main_window, 'hands-free: off', 'gray',
+                                                             self.toggle_hands_free, fg='black')
+        self.hands_free_button_main_window.place(x=750, y=100)
+
+        # Create and place the status label used by hands-free mode
+        self.status_label_main_window = util.get_text_label(self.main_window, '')
+        self.status_label_main_window.place(x=750, y=20)
+
         # Create and place the webcam label
         self.webcam_label = util.get_img_label(self.main_window)
         self.webcam_label.place(x=10, y=0, width=700, height=500) # Place the webcam label
 
         self.add_webcam(self.webcam_label)  # Add webcam to the label
+        self.main_window.protocol("WM_DELETE_WINDOW", self.close)  # Stop the capture thread on exit
 
         self.db_dir = './db'  # Set the database directory path
         if not os.path.exists(self.db_dir):  # Check if the database directory exists
             os.mkdir(self.db_dir)  # Create the database directory if it does not exist
 
-        self.log_path = './log.txt'  # Set the log file path
-        self.csv_log_path = './log.csv'  # Set the CSV log file path
+        self.stream_direction = None  # None while hands-free mode is off, else 'in' or 'out'
+
+        # Attendance events go to SQLite through a background writer (export CSV with events.py)
+        self.events = AttendanceStore('./attendance.db')
+
+        self.metrics_exporter = metrics.start_from_env()  # /metrics endpoint or periodic JSON dump, if configured
+
+        # The window and camera are up; the gallery and the dlib models load in the background
+        self.ready = False
+        self.load_error = None
+        self.enrollment = None  # Burst of the open registration window, encoded in the workers on accept
+        self.loader = threading.Thread(target=self.load_models, name='ModelLoader', daemon=True)
+        self.loader.start()
+        startup.mark('window built, camera opening')
+        self.wait_until_ready()
+
+    def load_models(self):
+        # Runs on the loader thread: no Tk calls here, wait_until_ready picks up the result
+        try:
+            self.store = open_store(self.db_dir)  # Open the packed store, migrating legacy pickles once
+            warn_bgr(self.store)  # Embeddings from before the switch to RGB encodings match less tightly
+            self.gallery = Gallery.from_store(self.store, index=open_index(self.db_dir, self.store.embeddings))  # Memory-map every enrolled embedding once
+            startup.mark('gallery loaded')
+
+            # Run detection and encoding in worker processes (dlib models load once per worker)
+            recognizer = RecognitionExecutor(self.gallery, workers=2, max_pending=8)
+            recognizer.warm_up()  # Start the workers now so the first login does not wait for dlib
+            self.recognizer = recognizer
+            startup.mark('recognition workers ready')
+
+            # Hands-free mode reads its own cursor of the camera feed and shares the worker pool
+            self.stream = AttendanceStream(self.grabber.consumer(), self.recognizer, self.on_stream_event)
+        except Exception as e:  # Shown in the status label instead of dying silently on the loader thread
+            self.load_error = e
+
+    def wait_until_ready(self):
+        if self.loader.is_alive():
+            self.status_label_main_window.config(text='Loading face models...')
+            self.main_window.after(100, self.wait_until_ready)
+            return
+        if self.load_error is not None:
+            self.status_label_main_window.config(text='Startup failed:\n{}'.format(self.load_error))
+            return
+
+        self.ready = True
+        self.status_label_main_window.config(text='')
+        self.poll_recognition()  # Start delivering recognition results to the GUI
+        startup.mark('ready')
+        if startup.ENABLED:
+            startup.report()
 
-        # Add header to CSV file if it doesn't exist
-        if not os.path.exists(self.csv_log_path):
-            with open(self.csv_log_path, 'w', newline='') as csvfile:
-                logwriter = csv.writer(csvfile)
-                logwriter.writerow(['Name', 'Date', 'Timestamp', 'Action'])  # Write the header
+    def check_ready(self):
+        if not self.ready:
+            util.msg_box('Please wait', 'The face models are still loading.')
+        return self.ready
 
     def add_webcam(self, label):
-        if 'cap' not in self.__dict__:  # Check if the webcam capture object is not already created
-            self.cap = cv2.VideoCapture(0)  # Create a webcam capture object
+        if 'grabber' not in self.__dict__:  # Check if the capture thread is not already running
+            self.grabber = FrameGrabber(0).start()  # Read the webcam on its own thread
+            self.preview_feed = self.grabber.consumer()  # Cursor used by the preview
+            self.recognition_feed = self.grabber.consumer()  # Independent cursor used by login/logout
 
         self._label = label  # Set the label to display the webcam feed
+        self.renderer = PreviewRenderer(label, 700, 500)  # Render at the label's placed size
         self.process_webcam()  # Start processing the webcam feed
 
     def process_webcam(self):
-        ret, frame = self.cap.read()  # Capture a frame from the webcam
+        # Take the newest frame without blocking the Tk thread, copied into the same buffer every time
+        frame = self.preview_feed.read(timeout=0, reuse=True)
 
-        self.most_recent_capture_arr = frame  # Store the most recent captured frame
-        img_ = cv2.cvtColor(self.most_recent_capture_arr, cv2.COLOR_BGR2RGB)  # Convert the frame to RGB
-        self.most_recent_capture_pil = Image.fromarray(img_)  # Convert the frame to a PIL image
-        imgtk = ImageTk.PhotoImage(image=self.most_recent_capture_pil)  # Convert the PIL image to an ImageTk object
-        self._label.imgtk = imgtk  # Set the ImageTk object to the label
-        self._label.configure(image=imgtk)  # Update the label with the new image
+        if frame is not None:
+            if 'most_recent_capture_arr' not in self.__dict__:
+                startup.mark('first frame')
+            self.most_recent_capture_arr = frame.image  # Store the most recent captured frame
+            self.renderer.render(frame.image)  # Resize, convert and paste into the label's PhotoImage
 
-        self._label.after(20, self.process_webcam)  # Schedule the next frame capture
+        self._label.after(self.renderer.interval, self.process_webcam)  # Backs off when rendering is slow
+
+    def get_recognition_frame(self):
+        frame = self.recognition_feed.read(timeout=0.5)  # Freshest frame, independent of the preview
+        if frame is None:
+            return self.most_recent_capture_arr  # Camera stalled: fall back to what is on screen
+        return frame.image
 
     def login(self):
-        # Detect all faces in the frame
-        face_locations = face_recognition.face_locations(self.most_recent_capture_arr)
-        face_encodings = face_recognition.face_encodings(self.most_recent_capture_arr, face_locations)
-
-        # Load all known face encodings from the database
-        known_face_encodings = []
-        known_face_names = []
-        for filename in os.listdir(self.db_dir):
-            if filename.endswith(".pickle"):
-                name = filename[:-7]  # Remove the '.pickle' extension
-                with open(os.path.join(self.db_dir, filename), 'rb') as f:
-                    encoding = pickle.load(f)
-                    known_face_encodings.append(encoding)
-                    known_face_names.append(name)
-
-        # Recognize each face in the frame
-        recognized_names = []
-        for face_encoding in face_encodings:
-            matches = face_recognition.compare_faces(known_face_encodings, face_encoding)
-            name = "unknown_person"
-            if True in matches:
-                first_match_index = matches.index(True)
-                name = known_face_names[first_match_index]
-            recognized_names.append(name)
+        # Detection and encoding run in a worker process; the result arrives in poll_recognition
+        if self.check_ready():
+            self.recognizer.submit(self.get_recognition_frame(), key='in')
 
-        # Log the recognized users
-        for name in recognized_names:
-            if name in ['unknown_person', 'no_persons_found']:
-                util.msg_box('Ups...', 'Unknown user detected. Please register new user or try again.')
+    def logout(self):
+        # Detection and encoding run in a worker process; the result arrives in poll_recognition
+        if self.check_ready():
+            self.recognizer.submit(self.get_recognition_frame(), key='out')
+
+    def poll_recognition(self):
+        for result in self.recognizer.poll():  # Finished requests, already matched against the gallery
+            if result.key.startswith('enroll-'):
+                self.on_enrollment_result(result)  # One frame of the registration burst
+                continue
+            if result.matches:
+                self.renderer.show_boxes(result.locations, [m.name for m in result.matches])  # Outline the faces on the preview
+            if result.key.startswith('stream-'):
+                self.stream.on_result(result)  # Hands-free detections and encodings
             else:
-                util.msg_box('Welcome back!', 'Welcome, {}.'.format(name))
-                with open(self.log_path, 'a') as f:  # Open the log file in append mode
-                    f.write('{},{},in\n'.format(name, datetime.datetime.now()))  # Write the login entry to the log file
-                with open(self.csv_log_path, 'a', newline='') as csvfile:  # Open the CSV log file in append mode
-                    logwriter = csv.writer(csvfile, delimiter=',')
-                    # Write the login entry with date and timestamp
-                    logwriter.writerow([name, datetime.datetime.now().date(), datetime.datetime.now().time(), 'in'])
+                self.on_recognized(result)
 
-    def logout(self):
-        # Detect all faces in the frame
-        face_locations = face_recognition.face_locations(self.most_recent_capture_arr)
-        face_encodings = face_recognition.face_encodings(self.most_recent_capture_arr, face_locations)
-
-        # Load all known face encodings from the database
-        known_face_encodings = []
-        known_face_names = []
-        for filename in os.listdir(self.db_dir):
-            if filename.endswith(".pickle"):
-                name = filename[:-7]  # Remove the '.pickle' extension
-                with open(os.path.join(self.db_dir, filename), 'rb') as f:
-                    encoding = pickle.load(f)
-                    known_face_encodings.append(encoding)
-                    known_face_names.append(name)
-
-        # Recognize each face in the frame
-        recognized_names = []
-        for face_encoding in face_encodings:
-            matches = face_recognition.compare_faces(known_face_encodings, face_encoding)
-            name = "unknown_person"
-            if True in matches:
-                first_match_index = matches.index(True)
-                name = known_face_names[first_match_index]
-            recognized_names.append(name)
+        if self.stream_direction is not None:
+            # Track faces on the newest frame and schedule detection/encoding, but only into free slots:
+            # submitting into a full executor would cancel the oldest request, maybe a Login/Logout press
+            free = self.recognizer.max_pending - len(self.recognizer.pending_keys())
+            self.stream.tick(max(0, free))
+
+        # Keep feeding the registration burst to the workers; finish once every frame is back
+        if self.enrollment is not None and self.enrollment.started and self.enrollment.submit(self.recognizer):
+            self.finish_register_new_user()
+
+        self.main_window.after(30, self.poll_recognition)  # Schedule the next poll
+
+    def toggle_hands_free(self):
+        # Cycle hands-free mode: off -> in -> out -> off
+        if not self.check_ready():
+            return
+        self.stream_direction = {None: 'in', 'in': 'out', 'out': None}[self.stream_direction]
+        self.stream.reset()
+        self.stream.direction = self.stream_direction
+        self.hands_free_button_main_window.config(text='hands-free: {}'.format(self.stream_direction or 'off'))
+        self.status_label_main_window.config(text='')
+
+    def on_stream_event(self, event):
+        # A tracked face was recognized once; log it without a blocking dialog
+        self.log_attendance(event.name, event.direction, event.distance)
+        greeting = 'Welcome, {}.' if event.direction == 'in' else 'Goodbye, {}.'
+        self.status_label_main_window.config(text=greeting.format(event.name))
+
+    def log_attendance(self, name, action, distance):
+        # Queue the event; the store's writer thread commits it in the next batch
+        self.events.record(name, action, confidence=max(0.0, 1.0 - distance))
+
+    def on_recognized(self, result):
+        if result.error is not None:  # The worker failed on this frame
+            util.msg_box('Ups...', 'Recognition failed. Please try again.')
+            return
+
+        # Recognize each face in the frame against the in-memory gallery (nearest match)
+        matches = result.matches
+        action = result.key  # 'in' for login, 'out' for logout
 
         # Log the recognized users
-        for name in recognized_names:
+        for name, distance, _ in matches:
             if name in ['unknown_person', 'no_persons_found']:
                 util.msg_box('Ups...', 'Unknown user detected. Please register new user or try again.')
             else:
-                util.msg_box('Hasta la vista!', 'Goodbye, {}.'.format(name))
-                with open(self.log_path, 'a') as f:  # Open the log file in append mode
-                    f.write('{},{},out\n'.format(name, datetime.datetime.now()))  # Write the logout entry to the log file
-                with open(self.csv_log_path, 'a', newline='') as csvfile:  # Open the CSV log file in append mode
-                    logwriter = csv.writer(csvfile, delimiter=',')
-                    # Write the logout entry with date and timestamp
-                    logwriter.writerow([name, datetime.datetime.now().date(), datetime.datetime.now().time(), 'out'])
+                if action == 'in':
+                    util.msg_box('Welcome back!', 'Welcome, {}.'.format(name))
+                else:
+                    util.msg_box('Hasta la vista!', 'Goodbye, {}.'.format(name))
+                self.log_attendance(name, action, distance)  # Record the attendance event
 
     def register_new_user(self):
+        if not self.check_ready():  # Enrollment needs the gallery and the workers
+            return
+
         # Create a new window for user registration
         self.register_new_user_window = tk.Toplevel(self.main_window)  # Create a new window for user registration
         self.register_new_user_window.geometry("1200x520+370+120")  # Set the size and position of the new window
@@ -173,36 +245,86 @@ class App:
         self.text_label_register_new_user = util.get_text_label(self.register_new_user_window, 'Please, \ninput username:')
         self.text_label_register_new_user.place(x=750, y=70)
 
+        # Collect a burst of sharp frames from the live feed while the user types their name
+        self.enrollment = Enrollment()
+        self.enrollment_feed = self.grabber.consumer()
+        self.enrollment_status_label = util.get_text_label(self.register_new_user_window, '')
+        self.enrollment_status_label.place(x=750, y=230)
+        self.collect_enrollment_frames()
+
+    def collect_enrollment_frames(self):
+        if not self.register_new_user_window.winfo_exists():  # Registration window was closed
+            return
+        if self.enrollment is None or self.enrollment.started:  # Accepted: the burst is being encoded
+            return
+        frame = self.enrollment_feed.read(timeout=0)
+        if frame is not None and not self.enrollment.full:
+            self.enrollment.offer(frame.image)
+        self.enrollment_status_label.configure(
+            text='samples: {}/{}'.format(len(self.enrollment.candidates), self.enrollment.frames))
+        if not self.enrollment.full:
+            self.main_window.after(100, self.collect_enrollment_frames)  # Spread the burst over a few poses
+
     def try_again_register_new_user(self):
+        self.enrollment = None  # Results still on their way are ignored
         self.register_new_user_window.destroy()  # Destroy the registration window
 
     def add_img_to_label(self, label):
-        imgtk = ImageTk.PhotoImage(image=self.most_recent_capture_pil)  # Convert the most recent capture to ImageTk
-        label.imgtk = imgtk  # Set the ImageTk object to the label
-        label.configure(image=imgtk)  # Update the label with the new image
-
         self.register_new_user_capture = self.most_recent_capture_arr.copy()  # Store the captured frame
+        PreviewRenderer(label, 700, 500).render(self.register_new_user_capture)  # Show it, scaled to the label
 
     def start(self):
         self.main_window.mainloop()  # Start the main event loop
 
+    def close(self):
+        self.grabber.stop()  # Stop the capture thread and release the webcam
+        self.loader.join()  # Closed while still loading: let the loader finish so its workers can be stopped
+        if 'recognizer' in self.__dict__:
+            self.recognizer.shutdown()  # Stop the worker processes and free the shared frames
+        self.events.close()  # Commit any queued attendance events
+        self.main_window.destroy()  # Close the main window
+
     def accept_register_new_user(self):
+        if self.enrollment.started:  # Accept was already pressed, the burst is being encoded
+            return
+
         # Save the captured image to the database
         name = self.entry_text_register_new_user.get(1.0, "end-1c")  # Get the entered username
 
         # Check if user already exists
-        if os.path.exists(os.path.join(self.db_dir, '{}.pickle'.format(name))):
+        if name in self.store:
             util.msg_box('Error!', 'User already registered!')
             return
 
-        embeddings = face_recognition.face_encodings(self.register_new_user_capture)[0]  # Get face embeddings
-        
-        # Save the embeddings to a file
-        file = open(os.path.join(self.db_dir, '{}.pickle'.format(name)), 'wb')  # Open a file to save embeddings
-        pickle.dump(embeddings, file)  # Save the embeddings to the file
+        if not self.enrollment.candidates:  # Camera stalled or every frame was blurry: use the snapshot
+            self.enrollment.offer(self.register_new_user_capture, force=True)
+
+        # Encode the burst in the worker processes; poll_recognition finishes the registration
+        self.enrollment_name = name
+        self.enrollment_status_label.configure(text='encoding {} samples...'.format(len(self.enrollment.candidates)))
+        self.enrollment.submit(self.recognizer)
+
+    def on_enrollment_result(self, result):
+        if result.context['enrollment'] is self.enrollment:  # Not from a registration window closed since
+            self.enrollment.on_result(result)
+
+    def finish_register_new_user(self):
+        enrollment, name = self.enrollment, self.enrollment_name
+        self.enrollment = None
+        if not self.register_new_user_window.winfo_exists():  # Registration window was closed meanwhile
+            return
+
+        # Keep the encodings of frames with exactly one face and store a few templates (journaled, all or nothing)
+        embeddings, best_frame = enrollment.finish()
+        if len(embeddings) == 0:
+            util.msg_box('Ups...', 'No face found. Please look at the camera and try again.')
+            self.enrollment = Enrollment()  # Collect a fresh burst for the next attempt
+            self.collect_enrollment_frames()
+            return
+        save_templates(name, self.store, self.gallery, enrollment, embeddings)
 
-        # Save the captured image as PNG
-        cv2.imwrite(os.path.join(self.db_dir, '{}.png'.format(name)), self.register_new_user_capture)
+        # Save the sharpest enrolled frame as PNG
+        cv2.imwrite(os.path.join(self.db_dir, '{}.png'.format(name)), best_frame)
 
         # Show success message
         util.msg_box('Success!', 'User was registered successfully !')  # Show success message
@@ -210,5 +332,6 @@ class App:
 
 
 if __name__ == "__main__":
+    startup.mark('imports')
     app = App()  # Create an instance of the App class
     app.start()  # Start the application
\ No newline at end of file
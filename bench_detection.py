@@ -0,0 +1,100 @@
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+import cv2
+
+import detection
+from tracking import iou
+
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def load_images(image_dir):
+    # Decode every sample image once, up front, so decoding is not part of the timings
+    images = []
+    for filename in sorted(os.listdir(image_dir)):
+        if not filename.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        frame = cv2.imread(os.path.join(image_dir, filename))
+        if frame is None:
+            print('skipping unreadable image {}'.format(filename), file=sys.stderr)
+            continue
+        images.append((filename, detection.to_rgb(frame)))
+    return images
+
+
+def recall(found, reference, threshold=0.5):
+    # Fraction of reference boxes matched by a found box with IoU >= threshold
+    hits = 0
+    remaining = list(found)
+    for ref in reference:
+        best = max(remaining, key=lambda box: iou(box, ref), default=None)
+        if best is not None and iou(best, ref) >= threshold:
+            remaining.remove(best)
+            hits += 1
+    return hits, len(reference)
+
+
+def run(images, profiles, reference='full', repeat=3):
+    # Returns one row per profile: name, mean ms, p95 ms, recall against the reference profile
+    truth = {name: detection.detect(rgb, reference) for name, rgb in images}
+
+    rows = []
+    for profile_name in profiles:
+        timings = []
+        hits = total = 0
+        for name, rgb in images:
+            for _ in range(repeat):
+                start = time.perf_counter()
+                boxes = detection.detect(rgb, profile_name)
+                timings.append((time.perf_counter() - start) * 1000)
+            h, t = recall(boxes, truth[name])
+            hits += h
+            total += t
+        timings = np.array(timings)
+        rows.append((profile_name, float(timings.mean()), float(np.percentile(timings, 95)),
+                     hits / total if total else float('nan')))
+    return rows
+
+
+def parse_profile(spec):
+    # A profile name, or scale:model:upsample[:top,right,bottom,left] for ad-hoc settings
+    if spec in detection.PROFILES:
+        return spec, spec
+    parts = spec.split(':')
+    roi = tuple(float(v) for v in parts[3].split(',')) if len(parts) > 3 else None
+    return spec, detection.DetectionProfile(float(parts[0]), parts[1], int(parts[2]), roi)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Detection latency/recall per profile on a directory of images.')
+    parser.add_argument('image_dir')
+    parser.add_argument('--profiles', nargs='+', default=['fast', 'balanced', 'full'],
+                        help='profile names or scale:model:upsample[:top,right,bottom,left]')
+    parser.add_argument('--reference', default='full', help='profile whose boxes count as ground truth')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    images = load_images(args.image_dir)
+    if not images:
+        print('no images found in {}'.format(args.image_dir))
+        return 1
+
+    profiles = dict(parse_profile(spec) for spec in args.profiles)
+    reference = parse_profile(args.reference)[1]
+
+    # detect() accepts names or DetectionProfile tuples alike
+    rows = run(images, list(profiles.values()), reference, args.repeat)
+    print('{} image(s), reference profile {}'.format(len(images), args.reference))
+    print('profile\tmean ms\tp95 ms\trecall')
+    for label, (_, mean_ms, p95_ms, rec) in zip(profiles, rows):
+        print('{}\t{:.1f}\t{:.1f}\t{:.3f}'.format(label, mean_ms, p95_ms, rec))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
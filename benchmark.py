@@ -0,0 +1,324 @@
+import os
+import sys
+import json
+import time
+import pickle
+import shutil
+import argparse
+import resource
+import threading
+import subprocess
+
+import numpy as np
+
+from index import EMBEDDING_DIM, INDEX_FILE, IVFIndex
+
+
+LAYOUTS = ('pickle', 'store', 'ivf')
+
+# Synthetic identities: dlib descriptors of different people sit ~0.9-1.2 apart, photos of the
+# same person ~0.3-0.5 apart. These spreads reproduce that with the default 0.6 tolerance.
+IDENTITY_SPREAD = 0.07
+QUERY_NOISE = 0.02
+
+
+def make_gallery(n, seed=0):
+    rng = np.random.default_rng(seed)
+    names = ['user{:06d}'.format(i) for i in range(n)]
+    return names, rng.normal(0, IDENTITY_SPREAD, (n, EMBEDDING_DIM)).astype(np.float32)
+
+
+def make_queries(embeddings, n, unknown=0.2, seed=1):
+    # Noisy copies of enrolled rows (expected name = row) plus a share of strangers (expected row = -1)
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, len(embeddings), n)
+    strangers = rng.random(n) < unknown
+    queries = embeddings[rows] + rng.normal(0, QUERY_NOISE, (n, EMBEDDING_DIM)).astype(np.float32)
+    queries[strangers] = rng.normal(0, IDENTITY_SPREAD, (int(strangers.sum()), EMBEDDING_DIM))
+    rows[strangers] = -1
+    return queries, rows
+
+
+def write_pickles(db_dir, names, embeddings):
+    # The layout App.accept_register_new_user used to write: one float64 array per <name>.pickle
+    os.makedirs(db_dir, exist_ok=True)
+    for name, row in zip(names, embeddings):
+        with open(os.path.join(db_dir, '{}.pickle'.format(name)), 'wb') as f:
+            pickle.dump(row.astype(np.float64), f)
+
+
+def write_store(db_dir, names, embeddings, ivf=False):
+    from store import EmbeddingStore
+
+    store = EmbeddingStore(db_dir)
+    store.append_many(names, embeddings)
+    if ivf:
+        nlist = max(1, min(len(embeddings), int(4 * np.sqrt(len(embeddings)))))
+        index = IVFIndex(nlist=nlist)
+        index.train(embeddings)
+        index.add(embeddings)
+        index.save(os.path.join(db_dir, INDEX_FILE))
+
+
+def prepare(workdir, sizes, layouts, seed=0):
+    # Generated galleries are cached under workdir/<layout>-<size>; delete workdir to regenerate
+    dirs = {}
+    for n in sizes:
+        names, embeddings = make_gallery(n, seed)
+        for layout in layouts:
+            db_dir = os.path.join(workdir, '{}-{}'.format(layout, n))
+            if not os.path.exists(db_dir):
+                tmp_dir = db_dir + '.tmp'
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                os.makedirs(tmp_dir)
+                start = time.perf_counter()
+                if layout == 'pickle':
+                    write_pickles(tmp_dir, names, embeddings)
+                else:
+                    write_store(tmp_dir, names, embeddings, ivf=layout == 'ivf')
+                os.rename(tmp_dir, db_dir)
+                print('generated {} in {:.1f}s'.format(db_dir, time.perf_counter() - start), file=sys.stderr)
+            dirs[layout, n] = db_dir
+    return dirs
+
+
+def legacy_recognize(embedding, db_dir, tolerance=0.6):
+    # What util.recognize did before the gallery existed: unpickle every file and compare one by one,
+    # for every query. Kept here only as the baseline the other layouts are measured against.
+    for filename in sorted(os.listdir(db_dir)):
+        if not filename.endswith('.pickle'):
+            continue
+        with open(os.path.join(db_dir, filename), 'rb') as f:
+            known = pickle.load(f)
+        if np.linalg.norm(known - embedding) <= tolerance:
+            return filename[:-7]
+    return 'unknown_person'
+
+
+# Run with `python -c` in a fresh interpreter, so the import time covers numpy and everything gallery
+# pulls in (benchmark.py itself imports numpy and index at the top). argv: package dir, gallery dir.
+COLD_START = """
+import time
+start = time.perf_counter()
+import sys
+sys.path.insert(0, sys.argv[1])
+from gallery import Gallery
+imported = time.perf_counter()
+gallery = Gallery.from_dir(sys.argv[2])
+loaded = time.perf_counter()
+import numpy as np
+from index import EMBEDDING_DIM
+gallery.match(np.zeros(EMBEDDING_DIM, dtype=np.float32))
+answered = time.perf_counter()
+import json
+from benchmark import peak_rss_mb
+print(json.dumps({'import_s': imported - start, 'load_s': loaded - imported,
+                  'first_query_s': answered - loaded, 'peak_rss_mb': peak_rss_mb()}))
+"""
+
+
+def peak_rss_mb():
+    # Linux keeps ru_maxrss across exec (a child would report its parent's peak), VmHWM does not
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024.0 * 1024.0) if sys.platform == 'darwin' else rss / 1024.0  # bytes on macOS, KiB elsewhere
+
+
+def worker_peak_rss_mb():
+    # Largest peak of any finished child process (the pool's workers once it has been shut down)
+    rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return rss / (1024.0 * 1024.0) if sys.platform == 'darwin' else rss / 1024.0
+
+
+def run_cold_start(db_dir):
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    return json.loads(subprocess.check_output([sys.executable, '-c', COLD_START, package_dir,
+                                               os.path.abspath(db_dir)]))
+
+
+def percentiles(seconds):
+    ms = 1000.0 * np.asarray(seconds)
+    return float(np.percentile(ms, 50)), float(np.percentile(ms, 95)), float(np.percentile(ms, 99))
+
+
+def bench_matching(db_dir, layout, queries, expected, legacy_queries=5):
+    # Per-query latency (one query at a time, as at the kiosk), batched throughput and accuracy
+    from gallery import Gallery
+
+    gallery = Gallery.from_dir(db_dir)
+    names = gallery.names
+    timings = []
+    correct = 0
+    for query, row in zip(queries, expected):
+        start = time.perf_counter()
+        name = gallery.match(query).name
+        timings.append(time.perf_counter() - start)
+        correct += name == (names[row] if row >= 0 else 'unknown_person')
+
+    start = time.perf_counter()
+    gallery.match_many(queries)
+    batch_qps = len(queries) / (time.perf_counter() - start)
+
+    if layout == 'pickle' and legacy_queries:
+        # The old path reloaded the whole directory for every query; measure it on a few queries only
+        legacy = []
+        for query in queries[:legacy_queries]:
+            start = time.perf_counter()
+            legacy_recognize(query, db_dir)
+            legacy.append(time.perf_counter() - start)
+        legacy_p50 = percentiles(legacy)[0]
+    else:
+        legacy_p50 = float('nan')
+
+    p50, p95, p99 = percentiles(timings)
+    return {'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99, 'qps': len(timings) / sum(timings),
+            'batch_qps': batch_qps, 'accuracy': correct / len(queries), 'legacy_p50_ms': legacy_p50}
+
+
+def gallery_suite(args):
+    dirs = prepare(args.workdir, args.sizes, args.layouts, args.seed)
+    rows = []
+    for (layout, n), db_dir in sorted(dirs.items(), key=lambda item: (item[0][1], LAYOUTS.index(item[0][0]))):
+        _, embeddings = make_gallery(n, args.seed)
+        queries, expected = make_queries(embeddings, args.queries, seed=args.seed + 1)
+        row = {'layout': layout, 'size': n}
+        row.update(run_cold_start(db_dir))
+        row.update(bench_matching(db_dir, layout, queries, expected, args.legacy_queries))
+        rows.append(row)
+        print('\t'.join(_format(row.get(column)) for column in GALLERY_COLUMNS), flush=True)
+    return rows
+
+
+GALLERY_COLUMNS = ('layout', 'size', 'import_s', 'load_s', 'first_query_s', 'peak_rss_mb',
+                   'p50_ms', 'p95_ms', 'p99_ms', 'qps', 'batch_qps', 'accuracy', 'legacy_p50_ms')
+
+
+def load_frames(image_dir):
+    from bench_detection import IMAGE_EXTENSIONS
+    import cv2
+
+    frames = []
+    for filename in sorted(os.listdir(image_dir)):
+        if filename.lower().endswith(IMAGE_EXTENSIONS):
+            frame = cv2.imread(os.path.join(image_dir, filename))
+            if frame is not None:
+                frames.append(frame)  # BGR, as the camera delivers it
+    return frames
+
+
+def bench_pipeline(gallery, frames, workers, profile='balanced', repeat=3):
+    # Replay the image set through detection + encoding in a worker pool and matching in the parent.
+    # Two client threads per worker keep the pool busy, like concurrent requests to server.py.
+    from workers import RecognitionExecutor
+
+    executor = RecognitionExecutor(gallery, workers=workers, max_pending=2 * workers, profile=profile)
+    try:
+        executor.run(frames[0], timeout=300)  # Warm-up: spawning workers loads the dlib models
+        jobs = [frames[i % len(frames)] for i in range(len(frames) * repeat)]
+        timings = []
+        faces = [0, 0]  # faces found, faces recognized
+        lock = threading.Lock()
+
+        def client(offset, step):
+            for frame in jobs[offset::step]:
+                start = time.perf_counter()
+                _, encodings = executor.run(frame, timeout=300)
+                matches = gallery.match_many(encodings)
+                elapsed = time.perf_counter() - start
+                with lock:
+                    timings.append(elapsed)
+                    faces[0] += len(matches)
+                    faces[1] += sum(m.name != 'unknown_person' for m in matches)
+
+        threads = [threading.Thread(target=client, args=(i, 2 * workers)) for i in range(2 * workers)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - start
+    finally:
+        executor.shutdown()
+
+    p50, p95, p99 = percentiles(timings)
+    return {'workers': workers, 'images': len(jobs), 'qps': len(jobs) / wall, 'p50_ms': p50, 'p95_ms': p95,
+            'p99_ms': p99, 'faces': faces[0], 'recognized': faces[1], 'peak_rss_mb': peak_rss_mb(),
+            'worker_peak_rss_mb': worker_peak_rss_mb()}
+
+
+PIPELINE_COLUMNS = ('workers', 'images', 'qps', 'p50_ms', 'p95_ms', 'p99_ms', 'faces', 'recognized', 'peak_rss_mb',
+                    'worker_peak_rss_mb')
+
+
+def pipeline_suite(args):
+    from gallery import Gallery
+
+    frames = load_frames(args.images)
+    if not frames:
+        print('no images found in {}'.format(args.images), file=sys.stderr)
+        return []
+    if args.db:
+        gallery = Gallery.from_dir(args.db)
+    else:
+        gallery = Gallery(*make_gallery(args.size, args.seed))
+
+    rows = []
+    for workers in args.workers:
+        row = bench_pipeline(gallery, frames, workers, args.profile, args.repeat)
+        rows.append(row)
+        print('\t'.join(_format(row[column]) for column in PIPELINE_COLUMNS), flush=True)
+    return rows
+
+
+def _format(value):
+    if isinstance(value, float):
+        return '{:.3f}'.format(value)
+    return str(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Headless recognition benchmarks (no camera, no Tk).')
+    parser.add_argument('--json', help='also write the results to this file, for tracking regressions')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    gallery = sub.add_parser('gallery', help='cold start, per-query latency and memory per gallery size and layout')
+    gallery.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 10000, 100000])
+    gallery.add_argument('--layouts', nargs='+', choices=LAYOUTS, default=list(LAYOUTS))
+    gallery.add_argument('--workdir', default='./bench-galleries')
+    gallery.add_argument('--queries', type=int, default=500)
+    gallery.add_argument('--legacy-queries', type=int, default=5,
+                         help='queries timed against the old reload-every-pickle path (0 to skip)')
+    gallery.add_argument('--seed', type=int, default=0)
+
+    pipeline = sub.add_parser('pipeline', help='replay images through detection, encoding and matching')
+    pipeline.add_argument('images', help='directory of sample images')
+    pipeline.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    pipeline.add_argument('--profile', default='balanced', help='detection profile, see detection.PROFILES')
+    pipeline.add_argument('--db', help='gallery directory (default: a synthetic gallery of --size users)')
+    pipeline.add_argument('--size', type=int, default=1000)
+    pipeline.add_argument('--repeat', type=int, default=3)
+    pipeline.add_argument('--seed', type=int, default=0)
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'gallery':
+        print('\t'.join(GALLERY_COLUMNS))
+        rows = gallery_suite(args)
+    else:
+        print('\t'.join(PIPELINE_COLUMNS))
+        rows = pipeline_suite(args)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'command': args.command, 'time': time.time(), 'rows': rows}, f, indent=1)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,318 @@
+import os
+import sys
+import csv
+import time
+import shutil
+import hashlib
+import argparse
+import datetime
+import multiprocessing
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from importlib import metadata
+
+import numpy as np
+import cv2
+
+import detection
+from enrollment import TEMPLATES, aggregate
+from index import EMBEDDING_DIM, INDEX_FILE, IVFIndex, load_index
+from store import VEC_FILE, IDX_FILE, JOURNAL_FILE, COLORSPACE, EmbeddingStore, open_store, store_lock, warn_bgr
+
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+CACHE_FILE = 'encodings.cache.npz'  # Per content hash + encoder settings: the embedding or why there is none
+SAVE_EVERY = 500  # Photos encoded between cache saves, so an interrupted run keeps most of its work
+
+_profile = None  # Set once per worker process by _init_encoder
+
+
+def _init_encoder(profile):
+    global _profile
+    detection.load()  # Load the dlib models once per worker, not per photo
+    _profile = detection.get_profile(profile)
+
+
+def _encode_photo(path):
+    # Worker side: returns (embedding, None, True) or (None, reason, cacheable). Photos must show exactly
+    # one face. An exception (cv2.error, a dlib RuntimeError) fails this photo only and is not cached.
+    try:
+        frame = cv2.imread(path)
+        if frame is None:
+            return None, 'unreadable image', True
+        rgb = detection.to_rgb(frame)
+        boxes = detection.detect(rgb, _profile)
+        if len(boxes) != 1:
+            return None, 'no face' if not boxes else '{} faces'.format(len(boxes)), True
+        return np.asarray(detection.encode(rgb, boxes)[0], dtype=np.float32), None, True
+    except Exception as e:
+        return None, '{}: {}'.format(type(e).__name__, e), False
+
+
+def encoder_settings(profile):
+    # Anything that changes the embedding of a photo; a change invalidates every cached entry
+    def version(package):
+        try:
+            return metadata.version(package)
+        except metadata.PackageNotFoundError:
+            return 'unknown'
+    profile = detection.get_profile(profile)
+    return 'scale={};model={};upsample={};roi={};face_recognition={};dlib={}'.format(
+        profile.scale, profile.model, profile.upsample, profile.roi, version('face_recognition'), version('dlib'))
+
+
+def content_key(path, settings):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return '{}|{}'.format(digest.hexdigest(), settings)
+
+
+class EncodingCache:
+    # Embeddings (or the reason a photo has none) keyed by content hash + encoder settings
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with np.load(path) as data:
+                for key, vector, error in zip(data['keys'], data['vectors'], data['errors']):
+                    self.entries[str(key)] = (vector if not error else None, str(error) or None)
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def put(self, key, embedding, error):
+        self.entries[key] = (embedding, error)
+
+    def save(self):
+        keys = list(self.entries)
+        vectors = np.zeros((len(keys), EMBEDDING_DIM), dtype=np.float32)
+        errors = []
+        for i, key in enumerate(keys):
+            embedding, error = self.entries[key]
+            if embedding is not None:
+                vectors[i] = embedding
+            errors.append(error or '')
+        tmp_path = self.path + '.tmp.npz'
+        np.savez(tmp_path, keys=np.array(keys, dtype=str), vectors=vectors, errors=np.array(errors, dtype=str))
+        os.replace(tmp_path, self.path)
+
+
+def photos_from_dir(path):
+    # photos/<name>.jpg is one photo of <name>; photos/<name>/*.jpg are several photos of <name>
+    photos = OrderedDict()
+    for entry in sorted(os.listdir(path)):
+        full = os.path.join(path, entry)
+        if os.path.isdir(full):
+            files = [os.path.join(full, f) for f in sorted(os.listdir(full)) if f.lower().endswith(IMAGE_EXTENSIONS)]
+            if files:
+                photos.setdefault(entry, []).extend(files)
+        elif entry.lower().endswith(IMAGE_EXTENSIONS):
+            photos.setdefault(os.path.splitext(entry)[0], []).append(full)
+    return photos
+
+
+def photos_from_csv(path):
+    # Rows of name,photo path; relative paths are relative to the CSV file. A header row is optional.
+    photos = OrderedDict()
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, newline='') as f:
+        for row in csv.reader(f):
+            if len(row) < 2 or not row[0].strip() or row[1].strip().lower() in ('path', 'photo', 'image'):
+                continue
+            photos.setdefault(row[0].strip(), []).append(os.path.join(base, row[1].strip()))
+    return photos
+
+
+def photos_from_db(db_dir):
+    # The <name>.png snapshots Main_Updated saves next to the store at registration
+    return OrderedDict((f[:-4], [os.path.join(db_dir, f)]) for f in sorted(os.listdir(db_dir)) if f.endswith('.png'))
+
+
+def encode_all(photos, cache, settings, profile='full', workers=None, progress=True):
+    # Returns {path: (embedding, error)} plus counters; only photos missing from the cache hit the pool
+    results = {}
+    todo = []  # (path, cache key)
+    counts = Counter()
+    for paths in photos.values():
+        for path in paths:
+            try:
+                key = content_key(path, settings)
+            except OSError as e:
+                results[path] = (None, 'unreadable file ({})'.format(e.strerror))
+                continue
+            cached = cache.get(key)
+            if cached is not None:
+                results[path] = cached
+                counts['cached'] += 1
+            else:
+                todo.append((path, key))
+
+    if todo:
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=min(workers, len(todo)),
+                                 mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_init_encoder, initargs=(profile,)) as pool:
+            paths = [path for path, _ in todo]
+            try:
+                for i, ((path, key), (embedding, error, cacheable)) in enumerate(
+                        zip(todo, pool.map(_encode_photo, paths, chunksize=4)), 1):
+                    results[path] = (embedding, error)
+                    if cacheable:
+                        cache.put(key, embedding, error)  # Failures are cached too: an unchanged bad photo stays bad
+                    counts['encoded'] += 1
+                    if progress and i % 100 == 0:
+                        print('encoded {}/{}'.format(i, len(todo)), file=sys.stderr)
+                    if i % SAVE_EVERY == 0:
+                        cache.save()
+            except BrokenProcessPool:  # A worker was killed (out of memory, a crash inside dlib)
+                for path, _ in todo:
+                    results.setdefault(path, (None, 'encoding worker died'))
+    return results, counts
+
+
+def templates_per_person(photos, results, templates=TEMPLATES):
+    # One row per person with a single usable photo, up to `templates` k-means centres otherwise
+    names, rows, meta = [], [], []
+    now = datetime.datetime.now().isoformat()
+    for name, paths in photos.items():
+        good = [results[p][0] for p in paths if results[p][0] is not None]
+        if not good:
+            continue
+        person_rows = aggregate(np.stack(good), templates)
+        for i, row in enumerate(person_rows):
+            names.append(name)
+            rows.append(row)
+            meta.append({'enrolled_at': now, 'template': i, 'samples': len(good), 'colorspace': COLORSPACE,
+                         'source': os.path.basename(paths[0]) if len(paths) == 1 else os.path.dirname(paths[0])})
+    embeddings = np.stack(rows) if rows else np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+    return names, embeddings, meta
+
+
+def rebuild_store(db_dir, names, embeddings, meta):
+    # Write a fresh store next to the old one, then swap its files in. The old files are kept as
+    # *.bak until both new files are in place, so an interrupted rebuild can be undone by hand.
+    # Call with store_lock(db_dir) held: a kiosk appending meanwhile would write into the old files.
+    # Its next append sees the new inode and header (EmbeddingStore.refresh) and lands after our rows.
+    tmp_dir = os.path.join(db_dir, '.rebuild')
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    EmbeddingStore(tmp_dir).append_many(names, embeddings, meta)
+
+    for filename in (IDX_FILE, VEC_FILE):
+        path = os.path.join(db_dir, filename)
+        if os.path.exists(path):
+            os.replace(path, path + '.bak')
+    for filename in (IDX_FILE, VEC_FILE):
+        os.replace(os.path.join(tmp_dir, filename), os.path.join(db_dir, filename))
+    for filename in (IDX_FILE + '.bak', VEC_FILE + '.bak', JOURNAL_FILE):  # The journal belonged to the old files
+        path = os.path.join(db_dir, filename)
+        if os.path.exists(path):
+            os.remove(path)
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    # Row numbers changed: a saved index must be rebuilt with its old settings. Without enough rows
+    # to train it, drop it; the gallery falls back to exact search without a second copy of the rows.
+    index_path = os.path.join(db_dir, INDEX_FILE)
+    if os.path.exists(index_path):
+        old = load_index(index_path)
+        if isinstance(old, IVFIndex) and len(embeddings) >= old.nlist:
+            index = IVFIndex(nlist=old.nlist, nprobe=old.nprobe)
+            index.train(embeddings)
+            index.add(embeddings)
+            index.save(index_path)
+        else:
+            os.remove(index_path)
+
+
+def replace_people(db_dir, store, names, embeddings, meta):
+    # Rewrite the store with these rows instead of any rows the same people had; everyone else keeps
+    # their rows. Returns the names whose rows were kept.
+    replaced = set(names)
+    with store_lock(db_dir):  # From here on nobody appends, and rows appended since we opened are kept
+        store.refresh()
+        keep = [i for i, name in enumerate(store.names) if name not in replaced]
+        all_names = names + [store.names[i] for i in keep]
+        all_rows = np.concatenate([embeddings, np.asarray(store.embeddings)[keep]])
+        all_meta = meta + [store.meta[i] for i in keep]
+        kept = sorted(set(store.names[i] for i in keep))
+        rebuild_store(db_dir, all_names, all_rows, all_meta)
+    return kept
+
+
+def report(photos, results, counts, elapsed, out=sys.stderr):
+    total = sum(len(paths) for paths in photos.values())
+    failures = [(path, results[path][1]) for paths in photos.values() for path in paths if results[path][1]]
+    print('{} photo(s) of {} person(s): {} encoded, {} from cache, {} without a usable face in {:.1f}s ({:.1f} photos/s)'
+          .format(total, len(photos), counts['encoded'], counts['cached'], len(failures), elapsed,
+                  total / elapsed if elapsed > 0 else float('nan')), file=out)
+    for reason, n in Counter(reason for _, reason in failures).most_common():
+        print('  {}: {}'.format(reason, n), file=out)
+    for path, reason in failures[:20]:
+        print('  {}\t{}'.format(path, reason), file=out)
+    if len(failures) > 20:
+        print('  ... and {} more'.format(len(failures) - 20), file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Enroll many people from photos, or re-encode the gallery.')
+    parser.add_argument('--db', default='./db')
+    parser.add_argument('--profile', default='full', help='detection profile, see detection.PROFILES')
+    parser.add_argument('--workers', type=int, default=None, help='encoding processes (default: one per core)')
+    parser.add_argument('--templates', type=int, default=TEMPLATES, help='rows kept per person with several photos')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    add = sub.add_parser('add', help='enroll people from a photo directory or a name,path CSV')
+    add.add_argument('source', help='directory of <name>.jpg / <name>/*.jpg, or a CSV of name,path')
+    add.add_argument('--replace', action='store_true',
+                     help='re-encode people already enrolled from these photos instead of skipping them')
+
+    sub.add_parser('rebuild', help='re-encode every person from the <name>.png saved in the db directory')
+
+    args = parser.parse_args(argv)
+    if not os.path.exists(args.db):
+        os.makedirs(args.db)
+
+    start = time.perf_counter()
+    store = open_store(args.db)
+    if args.command == 'add':
+        photos = photos_from_csv(args.source) if args.source.lower().endswith('.csv') else photos_from_dir(args.source)
+        already = [name for name in photos if name in store]
+        if already and not args.replace:
+            for name in already:
+                del photos[name]
+            print('skipping {} person(s) already enrolled (see --replace)'.format(len(already)), file=sys.stderr)
+    else:
+        photos = photos_from_db(args.db)
+
+    cache = EncodingCache(os.path.join(args.db, CACHE_FILE))
+    try:
+        results, counts = encode_all(photos, cache, encoder_settings(args.profile), args.profile, args.workers)
+    finally:
+        cache.save()  # Keep what was encoded, also on Ctrl-C
+    names, embeddings, meta = templates_per_person(photos, results, args.templates)
+
+    if args.command == 'add' and not any(name in store for name in names):
+        store.append_many(names, embeddings, meta)  # One journaled write for everyone
+        print('enrolled {} person(s), {} row(s)'.format(len(set(names)), len(names)), file=sys.stderr)
+    elif args.command == 'add':
+        replaced = set(name for name in names if name in store)
+        replace_people(args.db, store, names, embeddings, meta)
+        print('enrolled {} person(s), {} row(s); replaced the rows of {} already enrolled'.format(
+            len(set(names)) - len(replaced), len(names), len(replaced)), file=sys.stderr)
+    else:
+        # People without a usable PNG keep the rows they have
+        kept = replace_people(args.db, store, names, embeddings, meta)
+        print('re-encoded {} person(s); kept the existing rows of {} without a usable PNG{}'.format(
+            len(set(names)), len(kept), ': ' + ', '.join(kept[:10]) + (' ...' if len(kept) > 10 else '') if kept else ''),
+            file=sys.stderr)
+    warn_bgr(open_store(args.db))
+
+    report(photos, results, counts, time.perf_counter() - start)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
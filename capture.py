@@ -0,0 +1,219 @@
+import os
+import time
+import threading
+from collections import namedtuple
+
+import numpy as np
+import cv2
+
+import metrics
+
+
+# One captured frame: sequence number, capture time (time.monotonic) and the BGR image
+Frame = namedtuple('Frame', ['seq', 'timestamp', 'image'])
+
+
+class FrameGrabber:
+    # Reads a cv2.VideoCapture on its own thread into a small preallocated ring of the latest frames.
+    # The driver buffer is drained continuously, so consumers always see the newest frame.
+    # source is a device index, a stream URL (rtsp://...) or a video file. Files are played back at
+    # their own frame rate (realtime) and end the grabber at end of file; streams are reopened after
+    # reconnect_after consecutive failed reads.
+    def __init__(self, source=0, slots=4, api_preference=None, realtime=None, reconnect_after=100):
+        self.source = source
+        self.slots = slots
+        self.api_preference = api_preference
+        self.is_file = isinstance(source, str) and os.path.isfile(source)
+        self.realtime = self.is_file if realtime is None else realtime
+        self.reconnect_after = reconnect_after
+        self.ended = False  # A file source reached its end
+
+        self._cond = threading.Condition()
+        self._thread = None
+        self._running = False
+        self.cap = None
+        self.error = None
+
+        self._ring = None  # (slots, h, w, 3) uint8, allocated from the first frame
+        self._slot_seq = np.full(slots, -1, dtype=np.int64)  # -1 while a slot is being written
+        self._slot_time = np.zeros(slots, dtype=np.float64)
+        self._latest = -1
+
+        # Counters
+        self.frames_captured = 0
+        self.read_failures = 0
+        self.reconnects = 0
+        self.read_time_total = 0.0  # Seconds spent inside cap.read
+        self.read_time_max = 0.0
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='FrameGrabber-{}'.format(self.source), daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=2.0):
+        self._running = False
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if self.cap is not None:
+            self.cap.release()
+
+    @property
+    def is_opened(self):
+        return self.cap is not None and self.cap.isOpened()
+
+    def _open(self):
+        if self.api_preference is None:
+            return cv2.VideoCapture(self.source)
+        return cv2.VideoCapture(self.source, self.api_preference)
+
+    def _allocate(self, image):
+        self._ring = np.empty((self.slots,) + image.shape, dtype=image.dtype)
+        self._slot_seq[:] = -1
+
+    def _run(self):
+        try:
+            self.cap = self._open()
+        except cv2.error as e:
+            self.error = e
+            self._running = False
+            return
+
+        fps = self.cap.get(cv2.CAP_PROP_FPS) if self.realtime else 0.0
+        period = 1.0 / fps if fps and fps > 0 else 0.0
+        next_due = time.monotonic()
+        failures = 0
+
+        seq = 0
+        while self._running:
+            k = seq % self.slots
+            target = self._ring[k] if self._ring is not None else None
+
+            with self._cond:
+                self._slot_seq[k] = -1  # Readers copying this slot will notice and retry
+
+            start = time.monotonic()
+            ret, image = self.cap.read(target) if target is not None else self.cap.read()
+            now = time.monotonic()
+
+            if not ret or image is None:
+                self.read_failures += 1
+                failures += 1
+                if self.is_file:
+                    self.ended = True
+                    break
+                if failures >= self.reconnect_after:  # Camera unplugged or stream dropped: reopen it
+                    self.cap.release()
+                    self.cap = self._open()
+                    self.reconnects += 1
+                    failures = 0
+                time.sleep(0.01)  # Device hiccup: avoid a busy loop
+                continue
+            failures = 0
+
+            elapsed = now - start
+            self.read_time_total += elapsed
+            self.read_time_max = max(self.read_time_max, elapsed)
+            metrics.observe('cap_read', elapsed)
+            metrics.tick('capture')
+
+            if self._ring is None or image.shape != self._ring.shape[1:]:
+                with self._cond:
+                    self._allocate(image)
+            if not np.shares_memory(image, self._ring[k]):  # The driver allocated a new array
+                np.copyto(self._ring[k], image)
+
+            with self._cond:
+                self._slot_seq[k] = seq
+                self._slot_time[k] = now
+                self._latest = seq
+                self.frames_captured += 1
+                self._cond.notify_all()
+            seq += 1
+
+            if period:  # Play files back at their recorded rate instead of as fast as they decode
+                next_due = max(next_due + period, now - period)
+                time.sleep(max(0.0, next_due - time.monotonic()))
+
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()  # Wake readers so they see the end instead of waiting out their timeout
+
+    def latest(self, after=-1, timeout=None, out=None):
+        # Newest frame with seq > after, or None if none arrives in time (timeout=0 never blocks)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._cond:
+                while self._latest <= after:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if not self._running or (remaining is not None and remaining <= 0):
+                        return None
+                    self._cond.wait(remaining)
+                seq = self._latest
+                k = seq % self.slots
+                ring = self._ring
+                timestamp = float(self._slot_time[k])
+
+            if out is None or out.shape != ring.shape[1:]:
+                out = np.empty(ring.shape[1:], dtype=ring.dtype)
+            np.copyto(out, ring[k])
+
+            # Seqlock check: if the writer wrapped around onto this slot while we copied, retry
+            with self._cond:
+                if self._slot_seq[k] == seq and self._ring is ring:
+                    return Frame(seq, timestamp, out)
+
+    def consumer(self):
+        return FrameConsumer(self)
+
+    def stats(self):
+        captured = max(1, self.frames_captured)
+        return {
+            'frames_captured': self.frames_captured,
+            'read_failures': self.read_failures,
+            'reconnects': self.reconnects,
+            'read_ms_avg': 1000.0 * self.read_time_total / captured,
+            'read_ms_max': 1000.0 * self.read_time_max,
+        }
+
+
+class FrameConsumer:
+    # Independent cursor into a FrameGrabber: each consumer tracks its own position and counters
+    def __init__(self, grabber):
+        self.grabber = grabber
+        self.last_seq = -1
+        self.frames_read = 0
+        self.frames_dropped = 0  # Frames captured but never seen by this consumer
+        self.age_total = 0.0  # Seconds between capture and consumption
+        self.age_max = 0.0
+        self._out = None
+
+    def read(self, timeout=None, reuse=False):
+        # reuse=True copies into one buffer owned by this consumer instead of allocating a new array
+        frame = self.grabber.latest(self.last_seq, timeout, out=self._out if reuse else None)
+        if frame is None:
+            return None
+        if reuse:
+            self._out = frame.image
+
+        if self.last_seq >= 0:
+            self.frames_dropped += frame.seq - self.last_seq - 1
+        self.last_seq = frame.seq
+        self.frames_read += 1
+
+        age = time.monotonic() - frame.timestamp
+        self.age_total += age
+        self.age_max = max(self.age_max, age)
+        return frame
+
+    def stats(self):
+        read = max(1, self.frames_read)
+        return {
+            'frames_read': self.frames_read,
+            'frames_dropped': self.frames_dropped,
+            'latency_ms_avg': 1000.0 * self.age_total / read,
+            'latency_ms_max': 1000.0 * self.age_max,
+        }
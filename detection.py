@@ -0,0 +1,91 @@
+from collections import namedtuple
+
+import cv2
+
+import metrics
+
+
+# How to run detection on a frame:
+#   scale    - detect on a copy resized by this factor (boxes are mapped back to full resolution)
+#   model    - 'hog' (CPU friendly) or 'cnn' (more accurate, needs a GPU to be fast)
+#   upsample - how many times dlib upsamples the (scaled) image to find small faces
+#   roi      - optional (top, right, bottom, left) fractions of the frame to search, e.g. the door area
+DetectionProfile = namedtuple('DetectionProfile', ['scale', 'model', 'upsample', 'roi'])
+
+PROFILES = {
+    'fast': DetectionProfile(scale=0.25, model='hog', upsample=1, roi=None),
+    'balanced': DetectionProfile(scale=0.5, model='hog', upsample=1, roi=None),
+    'full': DetectionProfile(scale=1.0, model='hog', upsample=1, roi=None),  # face_recognition defaults
+    'accurate': DetectionProfile(scale=1.0, model='cnn', upsample=1, roi=None),
+}
+
+
+_face_recognition = None  # Imported on first use: loading dlib and its models takes seconds
+
+
+def load():
+    # Import face_recognition (and load the dlib models) now instead of on the first detection
+    global _face_recognition
+    if _face_recognition is None:
+        import face_recognition
+        _face_recognition = face_recognition
+    return _face_recognition
+
+
+def get_profile(profile):
+    if isinstance(profile, DetectionProfile):
+        return profile
+    if profile not in PROFILES:
+        raise ValueError('unknown detection profile {!r}, expected one of {}'.format(profile, sorted(PROFILES)))
+    return PROFILES[profile]
+
+
+def to_rgb(frame, dst=None):
+    # OpenCV frames are BGR, dlib expects RGB
+    with metrics.timer('cvtColor'):
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=dst)
+
+
+def roi_bounds(shape, roi):
+    h, w = shape[:2]
+    if roi is None:
+        return 0, w, h, 0
+    top, right, bottom, left = roi
+    return int(top * h), int(right * w), int(bottom * h), int(left * w)
+
+
+def detect(rgb, profile='balanced'):
+    # Detect on a cropped, downscaled copy and return boxes in full-resolution coordinates
+    profile = get_profile(profile)
+    h, w = rgb.shape[:2]
+    roi_top, roi_right, roi_bottom, roi_left = roi_bounds(rgb.shape, profile.roi)
+    view = rgb[roi_top:roi_bottom, roi_left:roi_right]  # A view, no copy
+
+    scale = profile.scale
+    if scale != 1.0:
+        size = (max(1, int(view.shape[1] * scale)), max(1, int(view.shape[0] * scale)))
+        view = cv2.resize(view, size, interpolation=cv2.INTER_AREA)
+
+    with metrics.timer('face_locations'):
+        locations = load().face_locations(view, profile.upsample, profile.model)
+
+    boxes = []
+    for top, right, bottom, left in locations:
+        boxes.append((max(0, int(top / scale) + roi_top),
+                      min(w, int(right / scale) + roi_left),
+                      min(h, int(bottom / scale) + roi_top),
+                      max(0, int(left / scale) + roi_left)))
+    return boxes
+
+
+def encode(rgb, boxes):
+    # Encodings are always computed on the full-resolution frame
+    if not boxes:
+        return []
+    with metrics.timer('face_encodings'):
+        return load().face_encodings(rgb, boxes)
+
+
+def detect_and_encode(rgb, profile='balanced'):
+    boxes = detect(rgb, profile)
+    return boxes, encode(rgb, boxes)
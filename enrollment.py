@@ -0,0 +1,128 @@
+import time
+import datetime
+
+import numpy as np
+import cv2
+
+from index import EMBEDDING_DIM, IVFIndex
+from store import COLORSPACE
+
+
+MIN_SHARPNESS = 60.0  # Variance of the Laplacian below this is motion blur or an out-of-focus frame
+BURST_FRAMES = 12  # Sharp frames kept from the live feed per enrollment
+TEMPLATES = 3  # Rows stored per identity: 1 stores the centroid, more store k-means centres
+
+
+def sharpness(frame):
+    gray = frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    return float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+
+def aggregate(embeddings, templates=TEMPLATES, seed=0):
+    # Compress the burst into `templates` rows: the mean, or the centres of a small k-means
+    embeddings = np.asarray(embeddings, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+    k = min(templates, len(embeddings))
+    if k <= 1:
+        return embeddings.mean(axis=0, keepdims=True)
+    quantizer = IVFIndex(nlist=k)  # Reuse the index's k-means
+    quantizer.train(embeddings, iterations=10, seed=seed, max_points_per_list=len(embeddings))
+    return quantizer.centroids
+
+
+class Enrollment:
+    # Collects a burst of frames for one person, keeps the sharp ones, encodes those with exactly
+    # one face and turns the encodings into a few templates for the store.
+    def __init__(self, frames=BURST_FRAMES, min_sharpness=MIN_SHARPNESS, templates=TEMPLATES):
+        self.frames = frames
+        self.min_sharpness = min_sharpness
+        self.templates = templates
+        self.candidates = []  # (sharpness, BGR frame)
+        self.rejected = {'blurry': 0, 'no_face': 0, 'several_faces': 0, 'error': 0}
+        self.results = None  # (locations, encodings) per candidate once submit() has started encoding
+        self._submitted = {}  # candidate index -> time of its last submission
+
+    @property
+    def full(self):
+        return len(self.candidates) >= self.frames
+
+    @property
+    def started(self):
+        return self.results is not None
+
+    @property
+    def done(self):
+        return self.results is not None and all(r is not None for r in self.results)
+
+    def offer(self, frame, force=False):
+        # Returns True if the frame was kept. Frames from a FrameConsumer may be reused, so keep a copy.
+        # force keeps the frame however blurry (e.g. the snapshot the user is looking at).
+        score = sharpness(frame)
+        if score < self.min_sharpness and not force:
+            self.rejected['blurry'] += 1
+            return False
+        self.candidates.append((score, frame.copy()))
+        return True
+
+    def submit(self, executor, key_prefix='enroll', retry_after=0.5):
+        # Non-blocking, safe on the Tk thread: queue candidates on the executor while it has free
+        # slots, without superseding anyone else's requests. Call again after every poll() until done;
+        # results come back through poll() with key '<key_prefix>-<i>' and go to on_result().
+        # A candidate that is neither answered nor pending any more (cancelled by another caller
+        # filling the queue) is submitted again after retry_after seconds.
+        if self.results is None:
+            self.results = [None] * len(self.candidates)
+        keys = set(executor.pending_keys())
+        free = executor.max_pending - len(keys)
+        now = time.monotonic()
+        for i, (_, frame) in enumerate(self.candidates):
+            if free <= 0:
+                break
+            key = '{}-{}'.format(key_prefix, i)
+            if self.results[i] is not None or key in keys or now - self._submitted.get(i, -retry_after) < retry_after:
+                continue
+            executor.submit(frame, key=key, context={'enrollment': self, 'index': i})
+            self._submitted[i] = now
+            free -= 1
+        return self.done
+
+    def on_result(self, result):
+        # A Result from RecognitionExecutor.poll() for one of the requests made by submit()
+        i = result.context['index']
+        if result.error is not None:
+            self.rejected['error'] += 1
+            self.results[i] = ([], [])
+        else:
+            self.results[i] = (result.locations, result.encodings)
+
+    def finish(self):
+        # (embeddings, best_frame) from the results collected through on_result()
+        return self._select(self.results)
+
+    def _select(self, results):
+        embeddings = []
+        best = None
+        for (score, frame), (locations, encodings) in zip(self.candidates, results):
+            if len(locations) != 1:  # Nobody, or someone else in the shot: ambiguous, skip it
+                self.rejected['no_face' if not locations else 'several_faces'] += 1
+                continue
+            embeddings.append(encodings[0])
+            if best is None or score > best[0]:
+                best = (score, frame)
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+        return embeddings, best[1] if best is not None else None
+
+    def templates_for(self, embeddings):
+        rows = aggregate(embeddings, self.templates)
+        now = datetime.datetime.now().isoformat()
+        meta = [{'enrolled_at': now, 'template': i, 'samples': len(embeddings), 'colorspace': COLORSPACE}
+                for i in range(len(rows))]
+        return rows, meta
+
+
+def save_templates(name, store, gallery, enrollment, embeddings):
+    # Append the templates for `embeddings` to the store and the live gallery; returns how many
+    rows, meta = enrollment.templates_for(embeddings)
+    store.append_many([name] * len(rows), rows, meta)  # One journaled write for all templates
+    gallery.add_many([name] * len(rows), rows)
+    return len(rows)
+
@@ -0,0 +1,298 @@
+import os
+import sys
+import csv
+import time
+import queue
+import socket
+import sqlite3
+import argparse
+import datetime
+import threading
+
+import metrics
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    person TEXT NOT NULL,
+    ts REAL NOT NULL,              -- seconds since the epoch (local clock of the kiosk)
+    direction TEXT NOT NULL CHECK (direction IN ('in', 'out')),
+    device TEXT NOT NULL DEFAULT '',
+    confidence REAL                -- 1 - face distance, NULL for imported rows
+);
+CREATE INDEX IF NOT EXISTS events_person_ts ON events (person, ts);
+CREATE INDEX IF NOT EXISTS events_ts ON events (ts);
+CREATE UNIQUE INDEX IF NOT EXISTS events_unique ON events (person, ts, direction, device);
+'''
+
+INSERT = 'INSERT OR IGNORE INTO events (person, ts, direction, device, confidence) VALUES (?, ?, ?, ?, ?)'
+
+DATE_FORMATS = ('%Y-%m-%d', '%m/%d/%Y', '%d/%m/%Y')
+TIME_FORMATS = ('%H:%M:%S.%f', '%H:%M:%S', '%H:%M')
+PARTIAL_TIME_FORMAT = '%M:%S.%f'  # log.csv rows re-saved by Excel ('41:51.5') lost the hour
+
+
+def connect(path):
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')  # Readers (reports, exports) never block the writer
+    conn.execute('PRAGMA synchronous=NORMAL')  # Safe with WAL: a crash loses at most the last batch
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def parse_timestamp(date_text, time_text=None, allow_partial=False):
+    # Accepts '2025-02-22 02:52:13.488123' or separate date/time columns in the formats seen in log.csv.
+    # With allow_partial, returns (datetime, hour_known) and accepts times missing the hour.
+    if time_text is None:
+        date_text, _, time_text = date_text.strip().partition(' ')
+    try:  # Fast path for the ISO timestamps the apps write
+        stamp = datetime.datetime.fromisoformat('{} {}'.format(date_text.strip(), time_text.strip()))
+        return (stamp, True) if allow_partial else stamp
+    except ValueError:
+        pass
+    for date_format in DATE_FORMATS:
+        try:
+            date = datetime.datetime.strptime(date_text.strip(), date_format).date()
+            break
+        except ValueError:
+            continue
+    else:
+        return (None, False) if allow_partial else None
+    for time_format in TIME_FORMATS + ((PARTIAL_TIME_FORMAT,) if allow_partial else ()):
+        try:
+            clock = datetime.datetime.strptime(time_text.strip(), time_format).time()
+        except ValueError:
+            continue
+        stamp = datetime.datetime.combine(date, clock)
+        return (stamp, time_format != PARTIAL_TIME_FORMAT) if allow_partial else stamp
+    return (None, False) if allow_partial else None
+
+
+def parse_log_txt_line(line):
+    # Lines written by App.login/App.logout: name,YYYY-MM-DD HH:MM:SS.ffffff,in|out
+    parts = line.strip().rsplit(',', 2)
+    if len(parts) != 3:
+        return None
+    name, stamp, direction = parts
+    return name, parse_timestamp(stamp), True, direction.strip()
+
+
+def parse_log_csv_row(row):
+    # Rows written by Main_Updated: Name,Date,Timestamp,Action
+    if len(row) != 4 or row[0] == 'Name':
+        return None
+    name, date_text, time_text, direction = row
+    stamp, hour_known = parse_timestamp(date_text, time_text, allow_partial=True)
+    return name, stamp, hour_known, direction.strip()
+
+
+def read_log_txt(path):
+    with open(path, newline='') as f:
+        for line in f:
+            event = parse_log_txt_line(line)
+            if event is not None:
+                yield event
+
+
+def read_log_csv(path):
+    with open(path, newline='') as f:
+        for row in csv.reader(f):
+            event = parse_log_csv_row(row)
+            if event is not None:
+                yield event
+
+
+class AttendanceStore:
+    # Attendance events in SQLite (WAL). record() only enqueues; one background thread
+    # writes the queue in batches, one transaction per batch.
+    def __init__(self, path='./attendance.db', device=None, max_queue=10000, batch_size=256, flush_interval=0.5):
+        self.path = path
+        self.device = device if device is not None else socket.gethostname()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._conn = connect(path)
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stop = object()
+        self.dropped = 0  # Events dropped because the queue was full
+        self.failed = 0  # Events lost because their batch could not be written
+        self.written = 0
+
+        self._thread = threading.Thread(target=self._run, name='AttendanceStore', daemon=True)
+        self._thread.start()
+
+    def record(self, person, direction, confidence=None, timestamp=None, device=None):
+        ts = timestamp if timestamp is not None else time.time()
+        item = (person, ts, direction, device if device is not None else self.device, confidence)
+        try:
+            self._queue.put_nowait(item)  # Called from the Tk thread: never wait for the writer
+        except queue.Full:
+            self.dropped += 1
+            metrics.inc('events_dropped')
+        metrics.gauge('event_queue', self._queue.qsize())
+
+    def _run(self):
+        stop = False
+        while not stop:
+            batch = []
+            waiters = []
+            item = self._queue.get()
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is self._stop:
+                    stop = True
+                elif isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    batch.append(item)
+                if stop or len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+
+            if batch:
+                try:
+                    with metrics.timer('event_write'), self._conn:  # One transaction per batch
+                        self._conn.executemany(INSERT, batch)
+                except Exception as e:  # Disk full, database locked past the timeout, a bad value...
+                    # The transaction was rolled back; lose this batch but keep the writer alive
+                    self.failed += len(batch)
+                    metrics.inc('events_failed', len(batch))
+                    print('attendance: could not write {} event(s) to {}: {}'.format(len(batch), self.path, e),
+                          file=sys.stderr)
+                else:
+                    self.written += len(batch)
+                    metrics.inc('events_written', len(batch))
+            for waiter in waiters:
+                waiter.set()
+        self._conn.close()
+
+    def flush(self, timeout=5.0):
+        # Block until everything recorded so far is committed
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self):
+        self._queue.put(self._stop)
+        self._thread.join()
+
+
+def _is_duplicate(conn, name, direction, stamp, hour_known, tolerance):
+    if hour_known:
+        ts = stamp.timestamp()
+        return conn.execute(
+            'SELECT 1 FROM events WHERE person = ? AND direction = ? AND ts BETWEEN ? AND ? LIMIT 1',
+            (name, direction, ts - tolerance, ts + tolerance)).fetchone() is not None
+
+    # Hour unknown: any event that day whose minutes and seconds match is the same event
+    day = datetime.datetime.combine(stamp.date(), datetime.time())
+    offset = stamp.minute * 60 + stamp.second + stamp.microsecond / 1e6
+    rows = conn.execute('SELECT ts FROM events WHERE person = ? AND direction = ? AND ts >= ? AND ts < ?',
+                        (name, direction, day.timestamp(), (day + datetime.timedelta(days=1)).timestamp()))
+    for (ts,) in rows:
+        delta = abs((ts - day.timestamp()) % 3600 - offset)
+        if min(delta, 3600 - delta) <= tolerance:
+            return True
+    return False
+
+
+def import_logs(db_path, paths, device='', tolerance=1.0):
+    # Import log.txt / log.csv files. Main_Updated wrote each event to both files with slightly
+    # different timestamps, so an event within `tolerance` seconds of an existing one is skipped.
+    # log.txt files go first whatever the argument order: their timestamps are complete, so hour-less
+    # log.csv rows can be matched to them. An hour-less row that matches nothing is not imported (its
+    # hour would be a guess) and is counted in no_hour. Returns (added, skipped, no_hour).
+    conn = connect(db_path)
+    added = skipped = no_hour = 0
+    with conn:
+        for path in sorted(paths, key=lambda p: p.lower().endswith('.csv')):
+            reader = read_log_csv if path.lower().endswith('.csv') else read_log_txt
+            for name, stamp, hour_known, direction in reader(path):
+                if stamp is None or direction not in ('in', 'out'):
+                    skipped += 1
+                    continue
+                if _is_duplicate(conn, name, direction, stamp, hour_known, tolerance):
+                    skipped += 1
+                    continue
+                if not hour_known:
+                    no_hour += 1
+                    continue
+                conn.execute(INSERT, (name, stamp.timestamp(), direction, device, None))
+                added += 1
+    conn.close()
+    return added, skipped, no_hour
+
+
+def export_csv(db_path, out, start=None, end=None, person=None):
+    # Stream events (optionally filtered by time range and person) to a CSV file object
+    query = 'SELECT person, ts, direction, device, confidence FROM events WHERE ts >= ? AND ts < ?'
+    params = [start.timestamp() if start else float('-inf'), end.timestamp() if end else float('inf')]
+    if person is not None:
+        query += ' AND person = ?'
+        params.append(person)
+
+    conn = connect(db_path)
+    writer = csv.writer(out)
+    writer.writerow(['Name', 'Date', 'Timestamp', 'Action', 'Device', 'Confidence'])
+    count = 0
+    for person_, ts, direction, device, confidence in conn.execute(query + ' ORDER BY ts', params):
+        stamp = datetime.datetime.fromtimestamp(ts)
+        writer.writerow([person_, stamp.date(), stamp.time(), direction, device,
+                         '' if confidence is None else '{:.3f}'.format(confidence)])
+        count += 1
+    conn.close()
+    return count
+
+
+def _date_arg(text):
+    stamp = parse_timestamp(text) if ' ' in text else parse_timestamp(text, '00:00')
+    if stamp is None:
+        raise argparse.ArgumentTypeError('cannot parse date {!r}'.format(text))
+    return stamp
+
+
+def _end_date_arg(text):
+    # The end is exclusive: a bare date means up to the end of that day, as in reports.py
+    stamp = _date_arg(text)
+    return stamp if ' ' in text.strip() else stamp + datetime.timedelta(days=1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Attendance event store tools.')
+    parser.add_argument('--db', default='./attendance.db')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    imp = sub.add_parser('import', help='import log.txt / log.csv files')
+    imp.add_argument('paths', nargs='*', default=['./log.txt', './log.csv'])
+    imp.add_argument('--device', default='')
+
+    exp = sub.add_parser('export', help='export events to CSV')
+    exp.add_argument('out', nargs='?', default='-', help='output file, - for stdout')
+    exp.add_argument('--from', dest='start', type=_date_arg)
+    exp.add_argument('--to', dest='end', type=_end_date_arg, help='last day (inclusive), or an exclusive date and time')
+    exp.add_argument('--person')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'import':
+        paths = [p for p in args.paths if os.path.exists(p)]
+        added, skipped, no_hour = import_logs(args.db, paths, device=args.device)
+        print('imported {} event(s) from {}, skipped {}'.format(added, ', '.join(paths) or 'nothing', skipped))
+        if no_hour:
+            print('{} log.csv row(s) lost their hour and match no log.txt event; not imported'.format(no_hour))
+    elif args.command == 'export':
+        if args.out == '-':
+            count = export_csv(args.db, sys.stdout, args.start, args.end, args.person)
+        else:
+            with open(args.out, 'w', newline='') as f:
+                count = export_csv(args.db, f, args.start, args.end, args.person)
+        print('exported {} event(s)'.format(count), file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
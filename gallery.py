@@ -0,0 +1,122 @@
+import os
+import pickle
+from collections import namedtuple
+
+import numpy as np
+
+import metrics
+from index import EMBEDDING_DIM, ExactIndex
+
+
+DEFAULT_TOLERANCE = 0.6  # Same default as face_recognition.compare_faces
+
+# Result of a gallery lookup: best name, its distance and the gap to the runner-up identity.
+# An identity may own several rows (templates from multi-sample enrollment); its distance is the
+# nearest of them, and the runner-up is always a different identity.
+Match = namedtuple('Match', ['name', 'distance', 'margin'])
+
+
+class Gallery:
+    def __init__(self, names=(), embeddings=None, tolerance=DEFAULT_TOLERANCE, index=None):
+        self.tolerance = tolerance
+        self.names = np.asarray(list(names), dtype=object)  # Names aligned with the embedding rows
+        self.exact = ExactIndex(embeddings)  # Contiguous (N, 128) float32 rows, also the exact backend
+
+        if len(self.names) != len(self.exact):
+            raise ValueError('got {} names for {} embeddings'.format(len(self.names), len(self.exact)))
+        if index is not None and len(index) != len(self.exact):
+            raise ValueError('index holds {} vectors, gallery has {}'.format(len(index), len(self.exact)))
+
+        self.index = index if index is not None else self.exact  # Backend used for lookups
+
+        # Integer identity label per row, so templates of one person can be told apart from other people
+        self._labels = {}
+        self.labels = np.array([self._labels.setdefault(name, len(self._labels)) for name in self.names],
+                               dtype=np.int64)
+        counts = np.bincount(self.labels) if len(self.labels) else np.zeros(0, dtype=np.int64)
+        self.max_templates = int(counts.max()) if len(counts) else 0
+
+    @classmethod
+    def from_store(cls, store, tolerance=DEFAULT_TOLERANCE, index=None):
+        # Wrap the memory-mapped rows of a packed EmbeddingStore without copying them
+        return cls(store.names, store.embeddings, tolerance=tolerance, index=index)
+
+    @classmethod
+    def from_dir(cls, db_path, tolerance=DEFAULT_TOLERANCE):
+        from store import EmbeddingStore  # Imported here because store.py imports this module
+        from index import open_index
+
+        with metrics.timer('gallery_load'):
+            if EmbeddingStore.exists(db_path):
+                store = EmbeddingStore(db_path, create=False)
+                return cls.from_store(store, tolerance=tolerance, index=open_index(db_path, store.embeddings))
+
+            # Legacy layout: load every <name>.pickle in the directory exactly once
+            names = []
+            rows = []
+            for filename in sorted(os.listdir(db_path)):
+                if not filename.endswith('.pickle'):
+                    continue
+                with open(os.path.join(db_path, filename), 'rb') as f:
+                    rows.append(np.asarray(pickle.load(f), dtype=np.float32))
+                names.append(filename[:-7])  # Remove the '.pickle' extension
+
+            embeddings = np.stack(rows) if rows else None
+            return cls(names, embeddings, tolerance=tolerance)
+
+    @property
+    def embeddings(self):
+        return self.exact.vectors
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def identities(self):
+        return len(self._labels)
+
+    def add(self, name, embedding):
+        self.add_many([name], embedding)
+
+    def add_many(self, names, embeddings):
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+        names = list(names)
+        if len(names) != len(embeddings):
+            raise ValueError('got {} names for {} embeddings'.format(len(names), len(embeddings)))
+        self.exact.add(embeddings)
+        if self.index is not self.exact:
+            self.index.add(embeddings)  # Incremental insert into the approximate backend
+        labels = np.array([self._labels.setdefault(name, len(self._labels)) for name in names], dtype=np.int64)
+        self.names = np.append(self.names, np.array(names, dtype=object))
+        self.labels = np.append(self.labels, labels)
+        self.max_templates = max(self.max_templates, int(np.bincount(self.labels).max()))
+
+    def distances(self, queries):
+        return self.exact.distances(queries)
+
+    def match_many(self, queries):
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+        if len(self) == 0:
+            metrics.inc('unknown_person', len(queries))
+            return [Match('unknown_person', float('inf'), float('inf')) for _ in range(len(queries))]
+
+        # No identity owns more than max_templates rows, so the nearest max_templates + 1 rows always
+        # include the runner-up identity when there is one (k=2 when everyone has a single row)
+        with metrics.timer('gallery_match'):
+            dist, ids = self.index.search(queries, min(len(self), self.max_templates + 1))
+
+            labels = np.where(ids >= 0, self.labels[ids], -1)
+            other = (labels != labels[:, :1]) & (ids >= 0)  # Rows belonging to a different identity
+            first_other = np.argmax(other, axis=1)
+            second_dist = np.where(other.any(axis=1), dist[np.arange(len(dist)), first_other], np.inf)
+
+        matches = []
+        for best_dist, runner_up, best in zip(dist[:, 0], second_dist, ids[:, 0]):
+            name = self.names[best] if best >= 0 and best_dist <= self.tolerance else 'unknown_person'
+            margin = runner_up - best_dist if best >= 0 else np.inf
+            matches.append(Match(name, float(best_dist), float(margin)))
+        metrics.inc('unknown_person', sum(m.name == 'unknown_person' for m in matches))
+        return matches
+
+    def match(self, embedding):
+        return self.match_many(embedding)[0]
@@ -0,0 +1,302 @@
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+
+EMBEDDING_DIM = 128  # Size of the face_recognition (dlib) face descriptor
+INDEX_FILE = 'gallery.ivf.npz'  # Persisted approximate index next to the packed store
+
+
+def squared_distances(queries, vectors, vector_sq_norms=None):
+    # |q - v|^2 = |q|^2 + |v|^2 - 2 q.v for every (query, vector) pair, clamped at zero
+    q_norms = np.einsum('ij,ij->i', queries, queries)
+    if vector_sq_norms is None:
+        vector_sq_norms = np.einsum('ij,ij->i', vectors, vectors)
+    sq = q_norms[:, None] + vector_sq_norms[None, :] - 2.0 * (queries @ vectors.T)
+    return np.maximum(sq, 0.0, out=sq)
+
+
+def _top_k(sq, ids, k):
+    # Pick the k smallest squared distances per row, sorted, padded with (inf, -1)
+    n_queries, n = sq.shape
+    out_dist = np.full((n_queries, k), np.inf, dtype=np.float32)
+    out_ids = np.full((n_queries, k), -1, dtype=np.int64)
+    if n == 0:
+        return out_dist, out_ids
+
+    kk = min(k, n)
+    part = np.argpartition(sq, kk - 1, axis=1)[:, :kk] if kk < n else np.tile(np.arange(n), (n_queries, 1))
+    part_sq = np.take_along_axis(sq, part, axis=1)
+    order = np.argsort(part_sq, axis=1)
+    part = np.take_along_axis(part, order, axis=1)
+
+    out_dist[:, :kk] = np.sqrt(np.take_along_axis(part_sq, order, axis=1))
+    out_ids[:, :kk] = ids[part]
+    return out_dist, out_ids
+
+
+def _as_rows(vectors, dim):
+    return np.ascontiguousarray(vectors, dtype=np.float32).reshape(-1, dim)
+
+
+class ExactIndex:
+    # Brute-force search over one contiguous (N, dim) float32 matrix
+    def __init__(self, vectors=None, dim=EMBEDDING_DIM):
+        self.dim = dim
+        self.vectors = _as_rows(vectors if vectors is not None else np.empty((0, dim)), dim)
+        self._sq_norms = None  # Cached |v|^2 per row, computed on the first query
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def add(self, vectors):
+        vectors = _as_rows(vectors, self.dim)
+        self.vectors = np.concatenate([self.vectors, vectors])
+        if self._sq_norms is not None:
+            self._sq_norms = np.concatenate([self._sq_norms, np.einsum('ij,ij->i', vectors, vectors)])
+
+    def distances(self, queries):
+        queries = _as_rows(queries, self.dim)
+        if self._sq_norms is None:
+            self._sq_norms = np.einsum('ij,ij->i', self.vectors, self.vectors)
+        return np.sqrt(squared_distances(queries, self.vectors, self._sq_norms))
+
+    def search(self, queries, k):
+        queries = _as_rows(queries, self.dim)
+        if self._sq_norms is None:
+            self._sq_norms = np.einsum('ij,ij->i', self.vectors, self.vectors)
+        sq = squared_distances(queries, self.vectors, self._sq_norms)
+        return _top_k(sq, np.arange(len(self.vectors)), k)
+
+    def save(self, path):
+        np.savez(path, kind='exact', vectors=self.vectors)
+
+
+class IVFIndex:
+    # Inverted file index: k-means coarse quantizer, only the nprobe nearest lists are scanned per query.
+    # nprobe is the recall/speed knob: nprobe == nlist is exact search.
+    def __init__(self, dim=EMBEDDING_DIM, nlist=256, nprobe=8):
+        self.dim = dim
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.centroids = None
+        self._list_ids = []
+        self._list_vectors = []
+        self._list_sizes = np.zeros(nlist, dtype=np.int64)
+        self.ntotal = 0
+
+    def __len__(self):
+        return self.ntotal
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    def train(self, vectors, iterations=20, seed=0, max_points_per_list=64):
+        vectors = _as_rows(vectors, self.dim)
+        if len(vectors) < self.nlist:
+            raise ValueError('need at least nlist={} training vectors, got {}'.format(self.nlist, len(vectors)))
+
+        rng = np.random.default_rng(seed)
+        sample_size = min(len(vectors), self.nlist * max_points_per_list)
+        sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+
+        centroids = sample[rng.choice(len(sample), self.nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assign = self._assign(sample, centroids)
+            counts = np.bincount(assign, minlength=self.nlist)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+
+            empty = counts == 0
+            centroids[~empty] = sums[~empty] / counts[~empty, None]
+            if empty.any():  # Re-seed empty lists on random points so every list stays useful
+                centroids[empty] = sample[rng.choice(len(sample), int(empty.sum()), replace=False)]
+
+        self.centroids = centroids
+        self._list_ids = [np.empty(0, dtype=np.int64) for _ in range(self.nlist)]
+        self._list_vectors = [np.empty((0, self.dim), dtype=np.float32) for _ in range(self.nlist)]
+        self._list_sizes = np.zeros(self.nlist, dtype=np.int64)
+        self.ntotal = 0
+
+    @staticmethod
+    def _assign(vectors, centroids, chunk=8192):
+        assign = np.empty(len(vectors), dtype=np.int64)
+        c_norms = np.einsum('ij,ij->i', centroids, centroids)
+        for start in range(0, len(vectors), chunk):
+            block = vectors[start:start + chunk]
+            assign[start:start + chunk] = np.argmin(squared_distances(block, centroids, c_norms), axis=1)
+        return assign
+
+    def _append_to_list(self, list_no, ids, vectors):
+        # Amortized growth: capacity doubles so one-at-a-time enrollment stays cheap
+        size = self._list_sizes[list_no]
+        needed = size + len(ids)
+        if needed > len(self._list_ids[list_no]):
+            capacity = max(needed, 2 * len(self._list_ids[list_no]), 16)
+            new_ids = np.empty(capacity, dtype=np.int64)
+            new_vectors = np.empty((capacity, self.dim), dtype=np.float32)
+            new_ids[:size] = self._list_ids[list_no][:size]
+            new_vectors[:size] = self._list_vectors[list_no][:size]
+            self._list_ids[list_no] = new_ids
+            self._list_vectors[list_no] = new_vectors
+
+        self._list_ids[list_no][size:needed] = ids
+        self._list_vectors[list_no][size:needed] = vectors
+        self._list_sizes[list_no] = needed
+
+    def add(self, vectors):
+        if not self.is_trained:
+            raise RuntimeError('IVFIndex must be trained before vectors are added')
+        vectors = _as_rows(vectors, self.dim)
+        ids = np.arange(self.ntotal, self.ntotal + len(vectors), dtype=np.int64)
+        assign = self._assign(vectors, self.centroids)
+
+        order = np.argsort(assign, kind='stable')
+        bounds = np.searchsorted(assign[order], np.arange(self.nlist + 1))
+        for list_no in np.flatnonzero(np.diff(bounds)):
+            rows = order[bounds[list_no]:bounds[list_no + 1]]
+            self._append_to_list(list_no, ids[rows], vectors[rows])
+
+        self.ntotal += len(vectors)
+
+    def search(self, queries, k, nprobe=None):
+        queries = _as_rows(queries, self.dim)
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+
+        out_dist = np.full((len(queries), k), np.inf, dtype=np.float32)
+        out_ids = np.full((len(queries), k), -1, dtype=np.int64)
+        if self.ntotal == 0 or len(queries) == 0:
+            return out_dist, out_ids
+
+        coarse = squared_distances(queries, self.centroids)
+        probes = np.argpartition(coarse, nprobe - 1, axis=1)[:, :nprobe] if nprobe < self.nlist else \
+            np.tile(np.arange(self.nlist), (len(queries), 1))
+
+        for i, lists in enumerate(probes):
+            lists = [l for l in lists if self._list_sizes[l]]
+            if not lists:
+                continue
+            ids = np.concatenate([self._list_ids[l][:self._list_sizes[l]] for l in lists])
+            vectors = np.concatenate([self._list_vectors[l][:self._list_sizes[l]] for l in lists])
+            dist, idx = _top_k(squared_distances(queries[i:i + 1], vectors), ids, k)
+            out_dist[i] = dist[0]
+            out_ids[i] = idx[0]
+        return out_dist, out_ids
+
+    def save(self, path):
+        ids = np.concatenate([self._list_ids[l][:self._list_sizes[l]] for l in range(self.nlist)])
+        vectors = np.concatenate([self._list_vectors[l][:self._list_sizes[l]] for l in range(self.nlist)])
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, kind='ivf', nprobe=self.nprobe, centroids=self.centroids,
+                 sizes=self._list_sizes, ids=ids, vectors=vectors)
+        os.replace(tmp_path, path)  # Never leave a half-written index behind
+
+    @classmethod
+    def _from_arrays(cls, data):
+        centroids = data['centroids']
+        index = cls(dim=centroids.shape[1], nlist=len(centroids), nprobe=int(data['nprobe']))
+        index.centroids = centroids
+        bounds = np.concatenate([[0], np.cumsum(data['sizes'])])
+        ids, vectors = data['ids'], data['vectors']  # Every data[...] access re-reads the array from the file
+        index._list_ids = [ids[bounds[l]:bounds[l + 1]].copy() for l in range(index.nlist)]
+        index._list_vectors = [vectors[bounds[l]:bounds[l + 1]].copy() for l in range(index.nlist)]
+        index._list_sizes = data['sizes'].astype(np.int64)
+        index.ntotal = int(bounds[-1])
+        return index
+
+
+def load_index(path):
+    with np.load(path) as data:
+        if str(data['kind']) == 'ivf':
+            return IVFIndex._from_arrays(data)
+        return ExactIndex(data['vectors'])
+
+
+def open_index(db_dir, vectors):
+    # Load the persisted index for db_dir, if any, and insert rows enrolled since it was saved
+    path = os.path.join(db_dir, INDEX_FILE)
+    if not os.path.exists(path):
+        return None
+    index = load_index(path)
+    if len(index) < len(vectors):
+        index.add(vectors[len(index):])
+    return index
+
+
+def recall_at_k(index, exact, queries, k=1, **search_kwargs):
+    # Fraction of the exact k nearest neighbours that the index also returns
+    _, approx_ids = index.search(queries, k, **search_kwargs)
+    _, exact_ids = exact.search(queries, k)
+    hits = sum(len(set(a[a >= 0]) & set(e[e >= 0])) for a, e in zip(approx_ids, exact_ids))
+    return hits / max(1, int((exact_ids >= 0).sum()))
+
+
+def evaluate(index, vectors, n_queries=1000, k=1, noise=0.05, seed=0, nprobes=None):
+    # Queries are perturbed gallery rows, which mimics a new capture of an enrolled face
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(vectors), min(n_queries, len(vectors)), replace=False)
+    queries = np.asarray(vectors[picks], dtype=np.float32) + rng.normal(0, noise, (len(picks), vectors.shape[1])).astype(np.float32)
+    exact = ExactIndex(vectors)
+
+    start = time.perf_counter()
+    exact.search(queries, k)
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    rows = []
+    for nprobe in nprobes or [getattr(index, 'nprobe', None)]:
+        kwargs = {'nprobe': nprobe} if nprobe is not None else {}
+        start = time.perf_counter()
+        index.search(queries, k, **kwargs)
+        ms = (time.perf_counter() - start) * 1000 / len(queries)
+        rows.append((nprobe, recall_at_k(index, exact, queries, k, **kwargs), ms, exact_ms))
+    return rows
+
+
+def main(argv=None):
+    from store import EmbeddingStore
+
+    parser = argparse.ArgumentParser(description='Build and evaluate the approximate gallery index.')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    build = sub.add_parser('build', help='train an IVF index over the packed store and save it')
+    build.add_argument('db_dir', nargs='?', default='./db')
+    build.add_argument('--nlist', type=int, default=None, help='number of lists (default: ~4*sqrt(N))')
+    build.add_argument('--nprobe', type=int, default=8)
+
+    recall = sub.add_parser('recall', help='report recall and latency of the saved index against exact search')
+    recall.add_argument('db_dir', nargs='?', default='./db')
+    recall.add_argument('--nprobe', type=int, nargs='*', default=None)
+    recall.add_argument('--queries', type=int, default=1000)
+    recall.add_argument('-k', type=int, default=1)
+
+    args = parser.parse_args(argv)
+    store = EmbeddingStore(args.db_dir, create=False)
+    vectors = store.embeddings
+
+    if args.command == 'build':
+        nlist = args.nlist or max(1, min(len(vectors), int(4 * np.sqrt(len(vectors)))))
+        index = IVFIndex(dim=store.dim, nlist=nlist, nprobe=args.nprobe)
+        start = time.perf_counter()
+        index.train(vectors)
+        index.add(vectors)
+        index.save(os.path.join(args.db_dir, INDEX_FILE))
+        print('built IVF index: {} vectors, {} lists, nprobe={} in {:.1f}s'.format(
+            len(index), nlist, args.nprobe, time.perf_counter() - start))
+    elif args.command == 'recall':
+        index = open_index(args.db_dir, vectors)
+        if index is None:
+            print('no index at {}, run "python index.py build" first'.format(os.path.join(args.db_dir, INDEX_FILE)))
+            return 1
+        print('nprobe\trecall@{}\tms/query\texact ms/query'.format(args.k))
+        for nprobe, recall, ms, exact_ms in evaluate(index, vectors, args.queries, args.k, nprobes=args.nprobe):
+            print('{}\t{:.4f}\t{:.3f}\t{:.3f}'.format(nprobe, recall, ms, exact_ms))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
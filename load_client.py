@@ -0,0 +1,97 @@
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import http.client
+from urllib.parse import urlparse
+
+import numpy as np
+
+
+def _payloads(args):
+    # Request bodies cycled by the clients: image files, or random embeddings near gallery rows
+    if args.images:
+        bodies = []
+        for filename in sorted(os.listdir(args.images)):
+            if filename.lower().endswith(('.jpg', '.jpeg', '.png')):
+                with open(os.path.join(args.images, filename), 'rb') as f:
+                    bodies.append(f.read())
+        return '/recognize', 'image/jpeg', bodies
+
+    rng = np.random.default_rng(args.seed)
+    if args.db:
+        from store import EmbeddingStore
+        rows = np.asarray(EmbeddingStore(args.db, create=False).embeddings)
+        base = rows[rng.integers(0, len(rows), 256)]
+    else:
+        base = rng.normal(0, 0.1, (256, 128))
+    bodies = []
+    for row in base:
+        query = row + rng.normal(0, 0.02, (args.faces, 128))
+        bodies.append(json.dumps({'embeddings': query.astype(np.float32).tolist()}).encode('utf-8'))
+    return '/match', 'application/json', bodies
+
+
+def _client(url, path, content_type, bodies, count, offset, latencies, errors):
+    conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=60)
+    for i in range(count):
+        body = bodies[(offset + i) % len(bodies)]
+        start = time.perf_counter()
+        try:
+            conn.request('POST', path, body, {'Content-Type': content_type})
+            response = conn.getresponse()
+            response.read()
+            if response.status != 200:
+                errors.append(response.status)
+                continue
+        except (OSError, http.client.HTTPException) as e:
+            errors.append(str(e))
+            conn.close()
+            conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=60)
+            continue
+        latencies.append(time.perf_counter() - start)
+    conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load generator for server.py.')
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--concurrency', type=int, default=16, help='parallel client connections')
+    parser.add_argument('--requests', type=int, default=2000, help='total requests')
+    parser.add_argument('--images', help='directory of JPEG/PNG frames to POST to /recognize')
+    parser.add_argument('--db', help='draw /match queries near the embeddings in this store')
+    parser.add_argument('--faces', type=int, default=1, help='embeddings per /match request')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    path, content_type, bodies = _payloads(args)
+    if not bodies:
+        print('nothing to send')
+        return 1
+
+    url = urlparse(args.url)
+    latencies = []
+    errors = []
+    per_client = args.requests // args.concurrency
+    threads = [threading.Thread(target=_client, args=(url, path, content_type, bodies, per_client, i * 7, latencies, errors))
+               for i in range(args.concurrency)]
+
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    ms = np.array(latencies) * 1000 if latencies else np.zeros(1)
+    print('{} {}: {} ok, {} error(s) in {:.2f}s -> {:.1f} req/s'.format(
+        path, args.concurrency, len(latencies), len(errors), elapsed, len(latencies) / elapsed))
+    print('latency ms: p50 {:.2f}  p95 {:.2f}  p99 {:.2f}  max {:.2f}'.format(
+        *np.percentile(ms, [50, 95, 99]), ms.max()))
+    return 0 if not errors else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
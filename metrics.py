@@ -0,0 +1,253 @@
+import os
+import json
+import time
+import bisect
+import threading
+
+
+# Histogram bucket upper bounds in seconds: 0.1 ms .. ~27 s, roughly x1.5 apart
+BUCKETS = tuple(round(0.0001 * 1.5 ** i, 7) for i in range(32))
+
+ENABLED = os.environ.get('FACE_METRICS', '') not in ('', '0')  # Off unless FACE_METRICS=1 or enable() is called
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last slot is +Inf
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        # list.__setitem__ with += is not atomic across threads, but a lost increment only skews a histogram
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def quantile(self, q):
+        # Linear interpolation inside the bucket holding the q-th observation (as Prometheus does)
+        if self.count == 0:
+            return float('nan')
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if seen + n >= rank and n:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+        return self.buckets[-1]
+
+
+class _Timer:
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+class _NullTimer:
+    # Shared no-op context manager returned while metrics are disabled
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+_gauges = {}
+_rates = {}
+
+
+def enable(on=True):
+    global ENABLED
+    ENABLED = on
+
+
+def _histogram(stage):
+    histogram = _histograms.get(stage)
+    if histogram is None:
+        with _lock:
+            histogram = _histograms.setdefault(stage, Histogram())
+    return histogram
+
+
+def timer(stage):
+    # with metrics.timer('face_locations'): ...
+    if not ENABLED:
+        return _NULL_TIMER
+    return _Timer(_histogram(stage))
+
+
+def observe(stage, seconds):
+    if ENABLED:
+        _histogram(stage).observe(seconds)
+
+
+def _key(name, labels):
+    # Counters and gauges are keyed by name, or by (name, sorted label pairs) when labelled
+    return (name, tuple(sorted(labels.items()))) if labels else name
+
+
+def _split(key):
+    return (key, ()) if isinstance(key, str) else key
+
+
+def _label_text(labels):
+    # {camera="front door"} with Prometheus escaping; '' without labels
+    if not labels:
+        return ''
+    escape = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join('{}="{}"'.format(k, escape(v)) for k, v in labels) + '}'
+
+
+def inc(name, value=1, labels=None):
+    # labels: e.g. {'camera': name}; one metric family whatever the label values are
+    if ENABLED:
+        key = _key(name, labels)
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def gauge(name, value, labels=None):
+    if ENABLED:
+        _gauges[_key(name, labels)] = value
+
+
+def tick(name):
+    # Frame-rate style gauge: call once per event, name_fps is the rate over the last second or so
+    if not ENABLED:
+        return
+    now = time.monotonic()
+    start, count = _rates.get(name, (now, 0))
+    count += 1
+    if now - start >= 1.0:
+        _gauges[name + '_fps'] = count / (now - start)
+        start, count = now, 0
+    _rates[name] = (start, count)
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+        _gauges.clear()
+        _rates.clear()
+
+
+def snapshot():
+    stages = {}
+    for stage, h in sorted(_histograms.items()):
+        stages[stage] = {
+            'count': h.count,
+            'mean_ms': 1000.0 * h.total / h.count if h.count else float('nan'),
+            'p50_ms': 1000.0 * h.quantile(0.50),
+            'p95_ms': 1000.0 * h.quantile(0.95),
+            'p99_ms': 1000.0 * h.quantile(0.99),
+        }
+    def flat(values):  # JSON keys are strings: 'in_flight{camera="front"}'
+        return {_split(key)[0] + _label_text(_split(key)[1]): value for key, value in values.items()}
+    return {'time': time.time(), 'stages': stages, 'counters': flat(dict(_counters)), 'gauges': flat(dict(_gauges))}
+
+
+def render_prometheus(prefix='face_attendance'):
+    lines = ['# TYPE {}_stage_seconds histogram'.format(prefix)]
+    for stage, h in sorted(_histograms.items()):
+        cumulative = 0
+        for bound, n in zip(h.buckets + ('+Inf',), h.counts):
+            cumulative += n
+            lines.append('{}_stage_seconds_bucket{{stage="{}",le="{}"}} {}'.format(prefix, stage, bound, cumulative))
+        lines.append('{}_stage_seconds_sum{{stage="{}"}} {}'.format(prefix, stage, h.total))
+        lines.append('{}_stage_seconds_count{{stage="{}"}} {}'.format(prefix, stage, h.count))
+    for values, kind, suffix in ((_counters, 'counter', '_total'), (_gauges, 'gauge', '')):
+        family = None
+        for key, value in sorted(dict(values).items(), key=lambda item: _split(item[0])):
+            name, labels = _split(key)
+            if name != family:  # One TYPE line per family, however many label sets it has
+                lines.append('# TYPE {}_{}{} {}'.format(prefix, name, suffix, kind))
+                family = name
+            lines.append('{}_{}{}{} {}'.format(prefix, name, suffix, _label_text(labels), value))
+    return '\n'.join(lines) + '\n'
+
+
+def _handler_class():
+    from http.server import BaseHTTPRequestHandler  # Imported here: http.server costs ~40 ms at startup
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == '/metrics':
+                body, content_type = render_prometheus().encode('utf-8'), 'text/plain; version=0.0.4'
+            elif self.path == '/metrics.json':
+                body, content_type = json.dumps(snapshot()).encode('utf-8'), 'application/json'
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return MetricsHandler
+
+
+def start_http_server(port=9100, host='127.0.0.1'):
+    # Serves /metrics (Prometheus text format) and /metrics.json on a daemon thread
+    from http.server import ThreadingHTTPServer
+
+    server = ThreadingHTTPServer((host, port), _handler_class())
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    return server
+
+
+def start_from_env():
+    # For the Tk apps: FACE_METRICS=1 enables collection, FACE_METRICS_PORT serves /metrics,
+    # FACE_METRICS_JSON names a file the snapshot is dumped to every FACE_METRICS_INTERVAL seconds
+    if not ENABLED:
+        return None
+    if os.environ.get('FACE_METRICS_PORT'):
+        return start_http_server(int(os.environ['FACE_METRICS_PORT']))
+    if os.environ.get('FACE_METRICS_JSON'):
+        return JsonDumper(os.environ['FACE_METRICS_JSON'], float(os.environ.get('FACE_METRICS_INTERVAL', 10)))
+    return None
+
+
+class JsonDumper:
+    # Writes snapshot() to a file every `interval` seconds (atomically, so readers never see half a file)
+    def __init__(self, path, interval=10.0):
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='metrics-json', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.dump()
+
+    def dump(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(snapshot(), f, indent=1)
+        os.replace(tmp_path, self.path)
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.dump()
@@ -0,0 +1,181 @@
+import sys
+import time
+import signal
+import argparse
+
+import metrics
+from gallery import Gallery
+from capture import FrameGrabber
+from workers import RecognitionExecutor
+from tracking import AttendanceStream
+from events import AttendanceStore
+
+
+def parse_source(text):
+    # Device indices become ints for cv2.VideoCapture; URLs and file paths stay strings
+    return int(text) if text.isdigit() else text
+
+
+class Camera:
+    # One entrance: a capture thread and a hands-free stream whose executor keys are unique to it.
+    # Keys start with 'cam<camera_id>-': the id is a plain number, so a key maps back to exactly one
+    # camera whatever characters the names contain ('gate' and 'gate-2' would share a name prefix).
+    def __init__(self, camera_id, name, source, direction, executor, on_event, **stream_options):
+        self.camera_id = camera_id
+        self.name = name
+        self.source = source
+        self.direction = direction
+        self.grabber = FrameGrabber(source).start()
+        self.stream = AttendanceStream(self.grabber.consumer(), executor,
+                                       lambda event: on_event(self, event),
+                                       direction=direction, key_prefix='cam{}'.format(camera_id), **stream_options)
+
+    @property
+    def ended(self):
+        return self.grabber.ended
+
+    def stats(self):
+        stream = self.stream
+        return dict(self.grabber.stats(), frames=stream.frames, detections=stream.detections,
+                    encodings=stream.encodings, events=stream.events, skipped=stream.skipped)
+
+
+class MultiCameraRunner:
+    # Drives several cameras from one thread against one worker pool and one in-memory gallery.
+    # Scheduling is round-robin with a rotating start, and no camera may have more than
+    # max_in_flight requests queued; a camera that is due while the pool is saturated only tracks
+    # that frame (its detection is skipped, not queued), so one busy entrance cannot starve the rest.
+    def __init__(self, executor, events=None, max_in_flight=2, tick_interval=0.01, **stream_options):
+        self.executor = executor
+        self.events = events
+        self.max_in_flight = max_in_flight
+        self.tick_interval = tick_interval
+        self.stream_options = stream_options
+        self.cameras = []
+        self._by_id = {}  # 'cam<camera_id>' -> Camera
+        self._turn = 0
+        self._running = False
+
+    def add(self, name, source, direction='in'):
+        if any(camera.name == name for camera in self.cameras):
+            raise ValueError('duplicate camera name {!r}'.format(name))
+        camera = Camera(len(self.cameras), name, source, direction, self.executor, self.on_event,
+                        **self.stream_options)
+        self.cameras.append(camera)
+        self._by_id[camera.stream.key_prefix] = camera
+        return camera
+
+    def on_event(self, camera, event):
+        print('{}\t{}\t{}\t{}\t{:.3f}'.format(time.strftime('%Y-%m-%d %H:%M:%S'), camera.name, event.name,
+                                             event.direction, event.distance), flush=True)
+        metrics.inc('camera_events', labels={'camera': camera.name})
+        if self.events is not None:
+            self.events.record(event.name, event.direction, confidence=max(0.0, 1.0 - event.distance),
+                               timestamp=event.timestamp, device=camera.name)
+
+    def _camera_for(self, key):
+        # Keys are '<key_prefix>-detect' / '<key_prefix>-encode-<track id>'
+        return self._by_id.get(key.split('-', 1)[0]) if key else None
+
+    def step(self):
+        # One scheduling round: deliver finished results, then give every camera one tick
+        for result in self.executor.poll():
+            camera = self._camera_for(result.key)
+            if camera is not None:
+                camera.stream.on_result(result)
+
+        # Count what each camera has queued from the executor itself, so superseded or dropped
+        # requests can never leave a camera looking busy forever
+        in_flight = {camera.camera_id: 0 for camera in self.cameras}
+        keys = self.executor.pending_keys()
+        for key in keys:
+            camera = self._camera_for(key)
+            if camera is not None:
+                in_flight[camera.camera_id] += 1
+
+        capacity = self.executor.max_pending - len(keys)
+        n = len(self.cameras)
+        for i in range(n):
+            camera = self.cameras[(self._turn + i) % n]
+            budget = max(0, min(capacity, self.max_in_flight - in_flight[camera.camera_id]))
+            submitted = camera.stream.tick(budget)
+            capacity -= submitted
+            metrics.gauge('camera_in_flight', in_flight[camera.camera_id] + submitted, labels={'camera': camera.name})
+        self._turn = (self._turn + 1) % max(1, n)
+        metrics.gauge('recognition_pending', self.executor.pending)
+
+    def run(self, duration=None, stats_interval=30.0):
+        self._running = True
+        start = last_stats = time.monotonic()
+        while self._running:
+            self.step()
+            now = time.monotonic()
+            if all(camera.ended for camera in self.cameras) and self.executor.pending == 0:
+                break  # Every source was a file and all of them have been played
+            if duration is not None and now - start >= duration:
+                break
+            if stats_interval and now - last_stats >= stats_interval:
+                last_stats = now
+                self.print_stats()
+            time.sleep(self.tick_interval)
+
+    def stop(self):
+        self._running = False
+
+    def print_stats(self):
+        for camera in self.cameras:
+            stats = camera.stats()
+            print('# {}: {frames} frames, {detections} detections, {encodings} encodings, {events} events, '
+                  '{skipped} skipped, {read_failures} read failures'.format(camera.name, **stats), file=sys.stderr)
+
+    def close(self):
+        for camera in self.cameras:
+            camera.grabber.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Hands-free attendance for several cameras in one process.')
+    parser.add_argument('--source', nargs='+', action='append', required=True, metavar='NAME SOURCE [in|out]',
+                        help='camera name, device index / rtsp:// URL / video file, and direction (default in)')
+    parser.add_argument('--db', default='./db')
+    parser.add_argument('--events-db', default='./attendance.db')
+    parser.add_argument('--workers', type=int, default=2, help='detection/encoding processes shared by all cameras')
+    parser.add_argument('--profile', default='balanced', help='detection profile, see detection.PROFILES')
+    parser.add_argument('--max-in-flight', type=int, default=2, help='requests one camera may have queued')
+    parser.add_argument('--detect-every', type=int, default=30, help='frames between detections without motion')
+    parser.add_argument('--duration', type=float, help='stop after this many seconds')
+    parser.add_argument('--metrics-port', type=int, help='serve /metrics on this port')
+    args = parser.parse_args(argv)
+
+    for spec in args.source:
+        if len(spec) not in (2, 3) or (len(spec) == 3 and spec[2] not in ('in', 'out')):
+            parser.error('--source takes NAME SOURCE [in|out], got {}'.format(' '.join(spec)))
+
+    if args.metrics_port:
+        metrics.enable()
+        metrics.start_http_server(args.metrics_port)
+
+    gallery = Gallery.from_dir(args.db)  # One copy of the gallery for every entrance
+    executor = RecognitionExecutor(gallery, workers=args.workers, max_pending=args.max_in_flight * len(args.source),
+                                   profile=args.profile)
+    events = AttendanceStore(args.events_db)
+    runner = MultiCameraRunner(executor, events, max_in_flight=args.max_in_flight, detect_every=args.detect_every)
+    signal.signal(signal.SIGTERM, lambda *_: runner.stop())
+
+    try:
+        for spec in args.source:
+            runner.add(spec[0], parse_source(spec[1]), spec[2] if len(spec) == 3 else 'in')
+        print('{} camera(s), {} enrolled embedding(s)'.format(len(runner.cameras), len(gallery)), file=sys.stderr)
+        runner.run(args.duration)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        runner.print_stats()
+        runner.close()
+        executor.shutdown()
+        events.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
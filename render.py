@@ -0,0 +1,88 @@
+import time
+
+import numpy as np
+import cv2
+from PIL import Image, ImageTk
+
+import metrics
+
+
+class PreviewRenderer:
+    # Draws camera frames into a Tk label at the label's size.
+    # The frame is shrunk in OpenCV before any conversion, into buffers allocated once per frame size;
+    # a single PhotoImage is updated in place with paste(), and the refresh interval backs off when
+    # rendering is slow so the preview never takes more than `budget` of the Tk thread.
+    def __init__(self, label, width, height, min_interval=20, max_interval=200, budget=0.25, overlay_ttl=1.5):
+        self.label = label
+        self.width = width
+        self.height = height
+        self.min_interval = min_interval  # ms
+        self.max_interval = max_interval
+        self.budget = budget
+        self.overlay_ttl = overlay_ttl  # Seconds a recognition box stays on screen
+
+        self.interval = min_interval  # ms until the next render, see after()
+        self.render_time = 0.0  # Exponential moving average, seconds
+        self.frames = 0
+
+        self._shape = None
+        self._scale = 1.0
+        self._small = None  # BGR at display size
+        self._rgba = None  # RGBA at display size, shared with self._image
+        self._image = None  # PIL image viewing self._rgba without a copy
+        self._photo = None
+        self._overlay = []  # (box in frame coordinates, text, colour)
+        self._overlay_time = 0.0
+
+    def _allocate(self, shape):
+        h, w = shape[:2]
+        self._scale = min(self.width / float(w), self.height / float(h))
+        size = (max(1, int(w * self._scale)), max(1, int(h * self._scale)))
+        self._small = np.empty((size[1], size[0], 3), dtype=np.uint8)
+        self._rgba = np.empty((size[1], size[0], 4), dtype=np.uint8)
+        self._image = Image.frombuffer('RGBA', size, self._rgba, 'raw', 'RGBA', 0, 1)
+        self._photo = ImageTk.PhotoImage('RGBA', size)
+        self.label.imgtk = self._photo  # Keep a reference, Tk does not
+        self.label.configure(image=self._photo)
+        self._shape = shape
+
+    def show_boxes(self, boxes, names=(), color=(0, 200, 0)):
+        # boxes are (top, right, bottom, left) in full-frame coordinates, e.g. Result.locations
+        names = list(names)
+        self._overlay = [(box, names[i] if i < len(names) else '', color) for i, box in enumerate(boxes)]
+        self._overlay_time = time.monotonic()
+
+    def _draw_overlay(self):
+        if not self._overlay:
+            return
+        if time.monotonic() - self._overlay_time > self.overlay_ttl:
+            self._overlay = []
+            return
+        s = self._scale
+        for (top, right, bottom, left), text, color in self._overlay:
+            p1, p2 = (int(left * s), int(top * s)), (int(right * s), int(bottom * s))
+            cv2.rectangle(self._small, p1, p2, color, 2)  # Drawn on the display-size buffer, in place
+            if text:
+                cv2.putText(self._small, text, (p1[0], max(12, p1[1] - 6)), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1)
+
+    def render(self, frame):
+        # frame is a BGR camera image of any size
+        start = time.perf_counter()
+        if frame.shape != self._shape:
+            self._allocate(frame.shape)
+
+        with metrics.timer('preview_render'):
+            # INTER_LINEAR: ~8x cheaper than INTER_AREA at non-integer ratios and fine for a preview
+            cv2.resize(frame, (self._small.shape[1], self._small.shape[0]), dst=self._small,
+                       interpolation=cv2.INTER_LINEAR)
+            self._draw_overlay()
+            cv2.cvtColor(self._small, cv2.COLOR_BGR2RGBA, dst=self._rgba)
+            self._photo.paste(self._image)  # Same Tk image every frame, nothing new to configure
+        metrics.tick('preview')
+
+        elapsed = time.perf_counter() - start
+        self.render_time = elapsed if self.frames == 0 else 0.9 * self.render_time + 0.1 * elapsed
+        self.frames += 1
+        # Keep rendering under `budget` of the Tk thread: a 10 ms render at budget 0.25 runs every 40 ms
+        wanted = 1000.0 * self.render_time / self.budget
+        self.interval = int(min(self.max_interval, max(self.min_interval, wanted)))
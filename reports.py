@@ -0,0 +1,303 @@
+import os
+import sys
+import csv
+import time
+import zlib
+import sqlite3
+import argparse
+import datetime
+
+import numpy as np
+
+import events
+
+
+IN, OUT = 1, 0
+DIRECTIONS = {'in': IN, 'out': OUT}
+HEAD_BYTES = 4096  # Bytes hashed to notice that a text log was rewritten rather than appended to
+MAX_SESSION = 16 * 3600  # An 'in' with no 'out' within this many seconds counts as a missing checkout
+
+
+class EventLog:
+    # Columnar, time-sorted attendance events: person codes, epoch seconds, local day ordinal, direction
+    def __init__(self, names, person, ts, day, direction):
+        self.names = list(names)
+        self.person = person
+        self.ts = ts
+        self.day = day
+        self.direction = direction
+
+    @classmethod
+    def empty(cls):
+        return cls([], np.empty(0, np.int32), np.empty(0, np.float64), np.empty(0, np.int32), np.empty(0, np.int8))
+
+    def __len__(self):
+        return len(self.ts)
+
+    def _take(self, selector):
+        return EventLog(self.names, self.person[selector], self.ts[selector], self.day[selector], self.direction[selector])
+
+    def between(self, start=None, end=None):
+        # Binary search on the sorted timestamps: the slice is a view, no copy
+        lo = 0 if start is None else int(np.searchsorted(self.ts, start, 'left'))
+        hi = len(self) if end is None else int(np.searchsorted(self.ts, end, 'left'))
+        return self._take(slice(lo, hi))
+
+    def for_person(self, name):
+        if name not in self.names:
+            return self._take(slice(0, 0))
+        return self._take(self.person == self.names.index(name))
+
+    def _pairs(self, max_session=MAX_SESSION):
+        # Pair every 'in' with the next event of the same person when that event is an 'out'
+        order = np.lexsort((self.ts, self.person))
+        person, ts, direction = self.person[order], self.ts[order], self.direction[order]
+        same = person[1:] == person[:-1]
+        paired = same & (direction[:-1] == IN) & (direction[1:] == OUT) & (ts[1:] - ts[:-1] <= max_session)
+        starts = np.flatnonzero(paired)
+        return order, starts
+
+    def sessions(self, max_session=MAX_SESSION):
+        order, starts = self._pairs(max_session)
+        first, second = order[starts], order[starts + 1]
+        return {
+            'person': self.person[first],
+            'start': self.ts[first],
+            'end': self.ts[second],
+            'day': self.day[first],
+            'duration': self.ts[second] - self.ts[first],
+        }
+
+    def missing_checkouts(self, max_session=MAX_SESSION):
+        order, starts = self._pairs(max_session)
+        is_paired = np.zeros(len(self), dtype=bool)
+        is_paired[order[starts]] = True
+        missing = np.flatnonzero((self.direction == IN) & ~is_paired)
+        return {'person': self.person[missing], 'ts': self.ts[missing], 'day': self.day[missing]}
+
+    def daily_hours(self, max_session=MAX_SESSION):
+        s = self.sessions(max_session)
+        keys = np.stack([s['person'], s['day']], axis=1)
+        if len(keys) == 0:
+            return {'person': keys[:, 0], 'day': keys[:, 1], 'hours': np.empty(0), 'sessions': np.empty(0, np.int64)}
+        unique, inverse = np.unique(keys, axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        return {
+            'person': unique[:, 0],
+            'day': unique[:, 1],
+            'hours': np.bincount(inverse, weights=s['duration']) / 3600.0,
+            'sessions': np.bincount(inverse),
+        }
+
+    def first_last(self):
+        # First 'in' and last 'out' per person and day (NaN when there is none)
+        keys = np.stack([self.person, self.day], axis=1)
+        if len(keys) == 0:
+            return {'person': keys[:, 0], 'day': keys[:, 1], 'first_in': np.empty(0), 'last_out': np.empty(0)}
+        unique, inverse = np.unique(keys, axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+
+        first_in = np.full(len(unique), np.inf)
+        last_out = np.full(len(unique), -np.inf)
+        ins, outs = self.direction == IN, self.direction == OUT
+        np.minimum.at(first_in, inverse[ins], self.ts[ins])
+        np.maximum.at(last_out, inverse[outs], self.ts[outs])
+        first_in[np.isinf(first_in)] = np.nan
+        last_out[np.isinf(last_out)] = np.nan
+        return {'person': unique[:, 0], 'day': unique[:, 1], 'first_in': first_in, 'last_out': last_out}
+
+
+class ColumnarCache:
+    # Keeps an EventLog in <source>.cache.npz and only parses what was appended to the source since
+    def __init__(self, source, cache_path=None):
+        self.source = source
+        self.cache_path = cache_path or source + '.cache.npz'
+        self.kind = 'sqlite' if source.endswith('.db') else ('csv' if source.lower().endswith('.csv') else 'txt')
+        self.skipped = 0  # Rows that could not be parsed (or lost their hour) in this update
+
+    def _load_cache(self):
+        if not os.path.exists(self.cache_path):
+            return None
+        with np.load(self.cache_path, allow_pickle=False) as data:
+            if str(data['source']) != os.path.abspath(self.source):
+                return None
+            log = EventLog(data['names'].tolist(), data['person'], data['ts'], data['day'], data['direction'])
+            return log, int(data['position']), int(data['head_crc'])
+
+    def _save_cache(self, log, position, head_crc):
+        tmp_path = self.cache_path + '.tmp.npz'
+        np.savez(tmp_path, source=os.path.abspath(self.source), names=np.array(log.names, dtype=str),
+                 person=log.person, ts=log.ts, day=log.day, direction=log.direction,
+                 position=position, head_crc=head_crc)
+        os.replace(tmp_path, self.cache_path)
+
+    def _head_crc(self, position):
+        # Identity of the source, to notice it was replaced: its first bytes, or its first event
+        if self.kind == 'sqlite':
+            conn = sqlite3.connect(self.source)
+            first = conn.execute('SELECT id, person, ts, direction FROM events ORDER BY id LIMIT 1').fetchone()
+            conn.close()
+            return zlib.crc32(repr(first).encode('utf-8')) if first is not None else 0
+        with open(self.source, 'rb') as f:
+            return zlib.crc32(f.read(min(position, HEAD_BYTES)))
+
+    def _size(self):
+        # What `position` counts: bytes of a text log, the last row id of a database
+        if self.kind != 'sqlite':
+            return os.path.getsize(self.source)
+        conn = sqlite3.connect(self.source)
+        last = conn.execute('SELECT MAX(id) FROM events').fetchone()[0]
+        conn.close()
+        return last or 0
+
+    def _read_text_tail(self, position):
+        # Parse complete lines appended after `position`, one at a time
+        rows = []
+        with open(self.source, 'rb') as f:
+            f.seek(position)
+            for raw in f:
+                if not raw.endswith(b'\n'):
+                    break  # A line still being written: pick it up next time
+                position += len(raw)
+                line = raw.decode('utf-8', errors='replace')
+                if self.kind == 'csv':
+                    event = events.parse_log_csv_row(next(csv.reader([line]), []))
+                else:
+                    event = events.parse_log_txt_line(line)
+                if event is None:
+                    continue
+                name, stamp, hour_known, direction = event
+                if stamp is None or not hour_known or direction not in DIRECTIONS:
+                    self.skipped += 1
+                    continue
+                rows.append((name, stamp.timestamp(), stamp.toordinal(), DIRECTIONS[direction]))
+        return rows, position
+
+    def _read_sqlite_tail(self, position):
+        rows = []
+        conn = sqlite3.connect(self.source)
+        last = position
+        for rowid, person, ts, direction in conn.execute(
+                'SELECT id, person, ts, direction FROM events WHERE id > ? ORDER BY id', (position,)):
+            rows.append((person, ts, datetime.datetime.fromtimestamp(ts).toordinal(), DIRECTIONS[direction]))
+            last = rowid
+        conn.close()
+        return rows, last
+
+    def load(self):
+        cached = self._load_cache()
+        log, position, head_crc = cached if cached is not None else (EventLog.empty(), 0, 0)
+
+        # Start over if the source shrank or its beginning changed (rotated, rewritten or recreated)
+        if cached is not None and (self._size() < position or self._head_crc(position) != head_crc):
+            log, position = EventLog.empty(), 0
+
+        self.skipped = 0
+        reader = self._read_sqlite_tail if self.kind == 'sqlite' else self._read_text_tail
+        rows, new_position = reader(position)
+        if rows:
+            log = self._append(log, rows)
+        if rows or new_position != position or cached is None:
+            self._save_cache(log, new_position, self._head_crc(new_position))
+        return log
+
+    @staticmethod
+    def _append(log, rows):
+        names = list(log.names)
+        codes = {name: i for i, name in enumerate(names)}
+        person = np.empty(len(rows), np.int32)
+        for i, row in enumerate(rows):
+            code = codes.get(row[0])
+            if code is None:
+                code = codes[row[0]] = len(names)
+                names.append(row[0])
+            person[i] = code
+
+        ts = np.fromiter((row[1] for row in rows), np.float64, len(rows))
+        day = np.fromiter((row[2] for row in rows), np.int32, len(rows))
+        direction = np.fromiter((row[3] for row in rows), np.int8, len(rows))
+
+        merged = EventLog(names, np.concatenate([log.person, person]), np.concatenate([log.ts, ts]),
+                          np.concatenate([log.day, day]), np.concatenate([log.direction, direction]))
+        if len(merged) > 1 and np.any(np.diff(merged.ts) < 0):  # Usually appended in order already
+            merged = merged._take(np.argsort(merged.ts, kind='stable'))
+        return merged
+
+
+def _clock(ts):
+    return '' if np.isnan(ts) else datetime.datetime.fromtimestamp(ts).strftime('%H:%M:%S')
+
+
+def _date(day):
+    return datetime.date.fromordinal(int(day)).isoformat()
+
+
+def _date_arg(text):
+    try:
+        return datetime.datetime.strptime(text, '%Y-%m-%d')
+    except ValueError:
+        raise argparse.ArgumentTypeError('expected YYYY-MM-DD, got {!r}'.format(text))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Attendance reports over the event log.')
+    parser.add_argument('report', choices=['daily', 'first-last', 'missing', 'sessions'])
+    parser.add_argument('--source', default=None, help='attendance.db, log.txt or log.csv (default: the first that exists)')
+    parser.add_argument('--cache', default=None, help='columnar cache file (default: <source>.cache.npz)')
+    parser.add_argument('--from', dest='start', type=_date_arg, help='first day, YYYY-MM-DD')
+    parser.add_argument('--to', dest='end', type=_date_arg, help='last day (inclusive), YYYY-MM-DD')
+    parser.add_argument('--person')
+    args = parser.parse_args(argv)
+
+    source = args.source or next((p for p in ('./attendance.db', './log.txt', './log.csv') if os.path.exists(p)), None)
+    if source is None or not os.path.exists(source):
+        print('no event log found', file=sys.stderr)
+        return 1
+
+    started = time.perf_counter()
+    cache = ColumnarCache(source, args.cache)
+    log = cache.load()
+    loaded = time.perf_counter()
+
+    start = args.start.timestamp() if args.start else None
+    end = (args.end + datetime.timedelta(days=1)).timestamp() if args.end else None
+    # Sessions may end after the range, so look a little past it when pairing
+    view = log.between(start, None if end is None else end + MAX_SESSION)
+    if args.person:
+        view = view.for_person(args.person)
+
+    writer = csv.writer(sys.stdout, delimiter='\t')
+    if args.report == 'daily':
+        rows = view.daily_hours()
+        writer.writerow(['person', 'date', 'hours', 'sessions'])
+        lines = [(log.names[p], _date(d), '{:.2f}'.format(h), n)
+                 for p, d, h, n in zip(rows['person'], rows['day'], rows['hours'], rows['sessions'])]
+    elif args.report == 'first-last':
+        rows = view.between(start, end).first_last()
+        writer.writerow(['person', 'date', 'first_in', 'last_out'])
+        lines = [(log.names[p], _date(d), _clock(f), _clock(l))
+                 for p, d, f, l in zip(rows['person'], rows['day'], rows['first_in'], rows['last_out'])]
+    elif args.report == 'missing':
+        rows = view.missing_checkouts()
+        writer.writerow(['person', 'date', 'in'])
+        lines = [(log.names[p], _date(d), _clock(t)) for p, d, t in zip(rows['person'], rows['day'], rows['ts'])]
+    else:
+        rows = view.sessions()
+        writer.writerow(['person', 'date', 'in', 'out', 'hours'])
+        lines = [(log.names[p], _date(d), _clock(s), _clock(e), '{:.2f}'.format(u / 3600.0))
+                 for p, d, s, e, u in zip(rows['person'], rows['day'], rows['start'], rows['end'], rows['duration'])]
+
+    if start is not None or end is not None:  # Keep only rows whose day falls in the requested range
+        first_day = args.start.toordinal() if args.start else -1
+        last_day = args.end.toordinal() if args.end else float('inf')
+        lines = [line for line in lines if first_day <= datetime.date.fromisoformat(line[1]).toordinal() <= last_day]
+    writer.writerows(sorted(lines, key=lambda line: (line[1], line[0])))
+
+    print('{} events from {} (load {:.1f} ms, query {:.1f} ms, {} row(s) skipped)'.format(
+        len(log), source, (loaded - started) * 1000, (time.perf_counter() - loaded) * 1000, cache.skipped),
+        file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,185 @@
+import sys
+import json
+import time
+import queue
+import argparse
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import cv2
+
+import metrics
+from gallery import Gallery
+from index import EMBEDDING_DIM
+from workers import RecognitionExecutor
+
+
+class MicroBatcher:
+    # Collects embedding lookups from concurrent requests and answers them with one
+    # vectorized gallery query per batch. A batch closes at max_batch rows or after max_wait.
+    def __init__(self, gallery, max_batch=64, max_wait=0.005):
+        self.gallery = gallery
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self.batches = 0
+        self.queries = 0
+        self._thread = threading.Thread(target=self._run, name='MicroBatcher', daemon=True)
+        self._thread.start()
+
+    def match(self, embeddings):
+        # Returns a Future resolving to one gallery.Match per row of embeddings
+        future = Future()
+        self._queue.put((np.asarray(embeddings, dtype=np.float32).reshape(-1, EMBEDDING_DIM), future))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            rows = len(batch[0][0])
+            deadline = time.monotonic() + self.max_wait
+            while rows < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(item)
+                rows += len(item[0])
+
+            try:
+                matches = self.gallery.match_many(np.concatenate([embeddings for embeddings, _ in batch]))
+            except Exception as e:  # Never leave a caller waiting forever
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.queries += rows
+            start = 0
+            for embeddings, future in batch:
+                future.set_result(matches[start:start + len(embeddings)])
+                start += len(embeddings)
+
+
+class RecognitionHandler(BaseHTTPRequestHandler):
+    # POST /recognize  body: JPEG/PNG bytes       -> faces with name, distance, margin and box
+    # POST /match      body: {"embeddings": [...]} -> one match per 128-d embedding
+    # GET  /health                                 -> gallery size and batching counters
+    # GET  /metrics                                -> stage timings in Prometheus text format (with --metrics)
+    protocol_version = 'HTTP/1.1'  # Keep-alive, so load generators do not pay for a connection per request
+    # Headers and body are separate small writes: with Nagle on, the body waits ~40 ms for the client's delayed ACK
+    disable_nagle_algorithm = True
+    server_version = 'FaceAttendance/1.0'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def do_GET(self):
+        if self.path == '/metrics' and metrics.ENABLED:
+            body = metrics.render_prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if self.path != '/health':
+            return self._reply(404, {'error': 'not found'})
+        batcher = self.server.batcher
+        self._reply(200, {'gallery': len(self.server.gallery), 'batches': batcher.batches, 'queries': batcher.queries})
+
+    def do_POST(self):
+        try:
+            if self.path == '/recognize':
+                return self._recognize()
+            if self.path == '/match':
+                return self._match()
+            self._reply(404, {'error': 'not found'})
+        except (ValueError, KeyError, TypeError) as e:  # Malformed body, e.g. JSON that is not an object
+            self._reply(400, {'error': str(e) or type(e).__name__})
+        except FutureTimeoutError:
+            self._reply(504, {'error': 'recognition timed out after {}s'.format(self.server.request_timeout)})
+
+    def _recognize(self):
+        if self.server.executor is None:
+            return self._reply(503, {'error': 'image recognition is not enabled on this server'})
+        frame = cv2.imdecode(np.frombuffer(self._body(), dtype=np.uint8), cv2.IMREAD_COLOR)
+        if frame is None:
+            raise ValueError('body is not a decodable image')
+        locations, encodings = self.server.executor.run(frame, timeout=self.server.request_timeout)
+        matches = self.server.batcher.match(encodings).result(self.server.request_timeout) if len(encodings) else []
+        self._reply(200, {'faces': [
+            {'name': m.name, 'distance': m.distance, 'margin': m.margin, 'box': [int(v) for v in box]}
+            for m, box in zip(matches, locations)
+        ]})
+
+    def _match(self):
+        embeddings = np.asarray(json.loads(self._body())['embeddings'], dtype=np.float32)
+        if embeddings.size % EMBEDDING_DIM:
+            raise ValueError('embeddings must have {} values each'.format(EMBEDDING_DIM))
+        matches = self.server.batcher.match(embeddings).result(self.server.request_timeout)
+        self._reply(200, {'matches': [{'name': m.name, 'distance': m.distance, 'margin': m.margin} for m in matches]})
+
+
+def make_server(gallery, host='127.0.0.1', port=8000, executor=None, max_batch=64, max_wait=0.005,
+                timeout=30.0, verbose=False):
+    server = ThreadingHTTPServer((host, port), RecognitionHandler)
+    server.daemon_threads = True
+    server.gallery = gallery
+    server.executor = executor
+    server.batcher = MicroBatcher(gallery, max_batch, max_wait)
+    server.request_timeout = timeout
+    server.verbose = verbose
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Headless face recognition service.')
+    parser.add_argument('--db', default='./db')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=2, help='detection/encoding processes')
+    parser.add_argument('--profile', default='balanced', help='detection profile, see detection.PROFILES')
+    parser.add_argument('--max-batch', type=int, default=64, help='embeddings per gallery lookup')
+    parser.add_argument('--max-wait-ms', type=float, default=5.0, help='longest a lookup waits for a batch to fill')
+    parser.add_argument('--metrics', action='store_true', help='collect stage timings and serve them at /metrics')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args(argv)
+
+    if args.metrics:
+        metrics.enable()
+
+    gallery = Gallery.from_dir(args.db)
+    executor = RecognitionExecutor(gallery, workers=args.workers, profile=args.profile)
+    server = make_server(gallery, args.host, args.port, executor, args.max_batch, args.max_wait_ms / 1000.0,
+                         verbose=args.verbose)
+    print('serving {} enrolled embedding(s) on http://{}:{}'.format(len(gallery), args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        executor.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,36 @@
+import os
+import sys
+import time
+import threading
+
+
+# Import this module first: its import time is the zero point of the report.
+# For a per-module breakdown of the import phase run the app with `python -X importtime`.
+START = time.perf_counter()
+
+ENABLED = os.environ.get('FACE_STARTUP_REPORT', '') not in ('', '0')  # Print the report once the app is ready
+
+_lock = threading.Lock()
+_marks = []  # (seconds since START, phase, thread name)
+
+
+def mark(phase):
+    # Record that `phase` finished now; safe to call from the background loader thread
+    with _lock:
+        _marks.append((time.perf_counter() - START, phase, threading.current_thread().name))
+
+
+def elapsed():
+    return time.perf_counter() - START
+
+
+def report(out=None):
+    # Phases in completion order: when each finished and how long since the previous one on the same thread
+    out = out or sys.stderr
+    with _lock:
+        marks = sorted(_marks)
+    print('startup phase\tat ms\tstep ms\tthread', file=out)
+    last = {}
+    for at, phase, thread in marks:
+        print('{}\t{:.0f}\t{:.0f}\t{}'.format(phase, 1000 * at, 1000 * (at - last.get(thread, 0.0)), thread), file=out)
+        last[thread] = at
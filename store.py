@@ -0,0 +1,360 @@
+import os
+import sys
+import json
+import struct
+import base64
+import pickle
+import zlib
+import datetime
+import argparse
+import contextlib
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, one writer per db directory is assumed
+    fcntl = None
+
+import metrics
+from index import EMBEDDING_DIM
+
+
+VEC_FILE = 'gallery.vec'  # Header + fixed-stride float32 embedding block
+IDX_FILE = 'gallery.idx'  # One JSON line per row: name and metadata
+JOURNAL_FILE = 'gallery.journal'  # Pending append, replayed on open if we crashed mid-write
+LOCK_FILE = 'gallery.lock'  # flock'ed by whoever recovers, appends to or rewrites the store
+
+# Colour space of the frames a row was encoded from, kept in its metadata. Encodings are computed on
+# RGB since detection.py; rows without the key (and migrated pickles) were encoded from BGR camera
+# frames and match less tightly until re-encoded.
+COLORSPACE = 'rgb'
+
+MAGIC = b'FGAL'
+VERSION = 1
+HEADER = struct.Struct('<4sIIQQ')  # magic, version, dim, committed row count, committed index size
+HEADER_SIZE = 64  # Header is padded so the embedding block stays aligned
+
+
+def _fsync_dir(path):
+    # Make a newly created or renamed file durable (not supported on every platform)
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+@contextlib.contextmanager
+def store_lock(db_dir):
+    # Exclusive between processes (a kiosk, bulk_enroll, a second app) for as long as the block runs.
+    # Closing the file releases the lock, also when the process dies.
+    with open(os.path.join(db_dir, LOCK_FILE), 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        yield
+
+
+class EmbeddingStore:
+    # create=False is for read-only tools: a missing store raises instead of leaving an empty one behind,
+    # which would stop open_store from ever migrating the pickles next to it
+    def __init__(self, db_dir, dim=EMBEDDING_DIM, create=True):
+        self.db_dir = db_dir
+        self.vec_path = os.path.join(db_dir, VEC_FILE)
+        self.idx_path = os.path.join(db_dir, IDX_FILE)
+        self.journal_path = os.path.join(db_dir, JOURNAL_FILE)
+
+        if not create and not os.path.exists(self.vec_path):
+            raise FileNotFoundError('no embedding store in {} (run store.py migrate first)'.format(db_dir))
+
+        self._names = None
+        self._name_set = None  # Same names as a set, for O(1) `name in store`
+        self._meta = None
+        self._map = None
+        self._map_count = -1
+
+        with store_lock(db_dir):  # Never replay or truncate under a writer that is still running
+            if not os.path.exists(self.vec_path):
+                self._create(dim)
+            self.dim, self.count, self.idx_size = self._read_header()
+            self._file_id = self._identity()
+            self.stride = self.dim * 4  # Bytes per float32 row
+            self._recover()
+
+    @staticmethod
+    def exists(db_dir):
+        return os.path.exists(os.path.join(db_dir, VEC_FILE))
+
+    def __len__(self):
+        return self.count
+
+    def _create(self, dim):
+        with open(self.vec_path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, dim, 0, 0).ljust(HEADER_SIZE, b'\0'))
+            f.flush()
+            os.fsync(f.fileno())
+        open(self.idx_path, 'wb').close()
+        _fsync_dir(self.db_dir)
+
+    def _read_header(self):
+        with open(self.vec_path, 'rb') as f:
+            magic, version, dim, count, idx_size = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('{} is not a version {} embedding store'.format(self.vec_path, VERSION))
+        return dim, count, idx_size
+
+    def _identity(self):
+        st = os.stat(self.vec_path)
+        return st.st_dev, st.st_ino
+
+    def refresh(self):
+        # Call under store_lock, before writing: pick up rows other processes appended since we last looked,
+        # or a store rewritten and swapped in by bulk_enroll (new inode), so we append after them
+        file_id = self._identity()
+        _, count, idx_size = self._read_header()
+        if file_id != self._file_id or count != self.count or idx_size != self.idx_size:
+            self._file_id = file_id
+            self.count, self.idx_size = count, idx_size
+            self._names = None  # Reloaded from the index file on next use
+            self._name_set = None
+            self._meta = None
+            self._map_count = -1
+
+    def _write_header(self, f, count, idx_size):
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, self.dim, count, idx_size))
+
+    def _recover(self):
+        # The header is the commit point: anything past it is a torn write unless the journal has it
+        journal = self._read_journal()
+        if journal is not None and journal['row'] == self.count:
+            self._apply(journal['names'], journal['meta'], journal['embeddings'])
+        elif self._file_size(self.vec_path) != HEADER_SIZE + self.count * self.stride or \
+                self._file_size(self.idx_path) != self.idx_size:
+            self._truncate()
+        self._clear_journal()
+
+    @staticmethod
+    def _file_size(path):
+        return os.path.getsize(path) if os.path.exists(path) else 0
+
+    def _truncate(self):
+        with open(self.vec_path, 'r+b') as f:
+            f.truncate(HEADER_SIZE + self.count * self.stride)
+        with open(self.idx_path, 'r+b') as f:
+            f.truncate(self.idx_size)
+
+    def _read_journal(self):
+        if not os.path.exists(self.journal_path):
+            return None
+        with open(self.journal_path, 'rb') as f:
+            data = f.read()
+        if not data.endswith(b'\n'):
+            return None  # Torn journal write: the append never returned, so drop it
+        try:
+            record = json.loads(data)
+            payload = base64.b64decode(record['embeddings'])
+            if zlib.crc32(payload) != record['crc']:
+                return None
+            embeddings = np.frombuffer(payload, dtype=np.float32).reshape(-1, self.dim)
+        except (ValueError, KeyError):
+            return None
+        return {'row': record['row'], 'names': record['names'], 'meta': record['meta'], 'embeddings': embeddings}
+
+    def _write_journal(self, names, meta, embeddings):
+        payload = embeddings.tobytes()
+        record = {
+            'row': self.count,
+            'names': names,
+            'meta': meta,
+            'embeddings': base64.b64encode(payload).decode('ascii'),
+            'crc': zlib.crc32(payload),
+        }
+        with open(self.journal_path, 'wb') as f:
+            f.write(json.dumps(record).encode('utf-8') + b'\n')
+            f.flush()
+            os.fsync(f.fileno())
+        _fsync_dir(self.db_dir)
+
+    def _clear_journal(self):
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+            _fsync_dir(self.db_dir)
+
+    def _apply(self, names, meta, embeddings):
+        # Idempotent: offsets come from the committed header, so replaying a journal is safe
+        lines = b''.join(json.dumps(dict(m, name=n)).encode('utf-8') + b'\n' for n, m in zip(names, meta))
+
+        with open(self.idx_path, 'r+b') as f:
+            f.truncate(self.idx_size)
+            f.seek(self.idx_size)
+            f.write(lines)
+            f.flush()
+            os.fsync(f.fileno())
+
+        with open(self.vec_path, 'r+b') as f:
+            f.seek(HEADER_SIZE + self.count * self.stride)
+            f.write(embeddings.tobytes())
+            f.truncate()
+            f.flush()
+            os.fsync(f.fileno())
+
+            self._write_header(f, self.count + len(names), self.idx_size + len(lines))
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.count += len(names)
+        self.idx_size += len(lines)
+
+        if self._names is not None:
+            self._names.extend(names)
+            self._name_set.update(names)
+            self._meta.extend(meta)
+
+    def append_many(self, names, embeddings, meta=None):
+        names = list(names)
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32).reshape(-1, self.dim)
+        if len(names) != len(embeddings):
+            raise ValueError('got {} names for {} embeddings'.format(len(names), len(embeddings)))
+        if not names:
+            return
+
+        now = datetime.datetime.now().isoformat()
+        meta = [dict(m) for m in meta] if meta is not None else [{'enrolled_at': now, 'colorspace': COLORSPACE}
+                                                                  for _ in names]
+
+        with store_lock(self.db_dir):
+            self.refresh()
+            self._recover()  # A writer that crashed since we opened the store
+            self._write_journal(names, meta, embeddings)
+            self._apply(names, meta, embeddings)
+            self._clear_journal()
+
+    def append(self, name, embedding, **meta):
+        self.append_many([name], embedding, meta=[meta] if meta else None)
+
+    def bgr_names(self):
+        # People with rows encoded from BGR frames, see COLORSPACE
+        return sorted(set(name for name, m in zip(self.names, self.meta) if m.get('colorspace', 'bgr') == 'bgr'))
+
+    def _load_index(self):
+        names = []
+        meta = []
+        with open(self.idx_path, 'rb') as f:
+            for line in f.read(self.idx_size).splitlines():
+                entry = json.loads(line)
+                names.append(entry.pop('name'))
+                meta.append(entry)
+        self._names = names
+        self._name_set = set(names)
+        self._meta = meta
+
+    @property
+    def names(self):
+        if self._names is None:
+            self._load_index()
+        return self._names
+
+    @property
+    def meta(self):
+        if self._meta is None:
+            self._load_index()
+        return self._meta
+
+    @property
+    def embeddings(self):
+        # Read-only memory map of the committed rows; remapped only when the store has grown
+        if self._map_count != self.count:
+            if self.count == 0:
+                self._map = np.empty((0, self.dim), dtype=np.float32)
+            else:
+                self._map = np.memmap(self.vec_path, dtype=np.float32, mode='r',
+                                      offset=HEADER_SIZE, shape=(self.count, self.dim))
+            self._map_count = self.count
+        return self._map
+
+    def __contains__(self, name):
+        if self._name_set is None:
+            self._load_index()
+        return name in self._name_set
+
+
+def migrate_pickles(db_dir, store=None):
+    # Pack every legacy <name>.pickle in db_dir into the store, skipping names it already holds
+    store = store if store is not None else EmbeddingStore(db_dir)
+    known = set(store.names)
+
+    names = []
+    rows = []
+    meta = []
+    for filename in sorted(os.listdir(db_dir)):
+        if not filename.endswith('.pickle') or filename[:-7] in known:
+            continue
+        path = os.path.join(db_dir, filename)
+        with open(path, 'rb') as f:
+            rows.append(np.asarray(pickle.load(f), dtype=np.float32))
+        names.append(filename[:-7])  # Remove the '.pickle' extension
+        meta.append({'source': filename, 'colorspace': 'bgr',  # The old apps encoded the raw camera frame
+                     'enrolled_at': datetime.datetime.fromtimestamp(os.path.getmtime(path)).isoformat()})
+
+    if names:
+        store.append_many(names, np.stack(rows), meta=meta)
+    return store, len(names)
+
+
+def open_store(db_dir):
+    # Open the packed store and pack any <name>.pickle it does not hold yet (all of them the first time)
+    with metrics.timer('store_open'):
+        store, _ = migrate_pickles(db_dir)
+        return store
+
+
+def warn_bgr(store, out=None):
+    # Tell the operator which people still have BGR-encoded rows and how to re-encode them
+    names = store.bgr_names()
+    if names:
+        print('warning: {} person(s) have embeddings encoded from BGR frames and will match less tightly: {}{}\n'
+              '  re-encode them with `bulk_enroll.py rebuild` (uses db/<name>.png) or '
+              '`bulk_enroll.py add --replace <photos>`'.format(
+                  len(names), ', '.join(names[:10]), ' ...' if len(names) > 10 else ''), file=out or sys.stderr)
+    return names
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Packed face embedding store tools.')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    migrate = sub.add_parser('migrate', help='convert a ./db directory of <name>.pickle files')
+    migrate.add_argument('db_dir', nargs='?', default='./db')
+    migrate.add_argument('--remove-pickles', action='store_true', help='delete the pickles once packed')
+
+    info = sub.add_parser('info', help='print the store size and names')
+    info.add_argument('db_dir', nargs='?', default='./db')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'migrate':
+        store, added = migrate_pickles(args.db_dir)
+        print('migrated {} pickle(s), store now holds {} embedding(s)'.format(added, len(store)))
+        if args.remove_pickles:
+            for name in set(store.names):
+                path = os.path.join(args.db_dir, '{}.pickle'.format(name))
+                if os.path.exists(path):
+                    os.remove(path)
+    elif args.command == 'info':
+        store = EmbeddingStore(args.db_dir, create=False)
+        print('{} embedding(s) of dim {}'.format(len(store), store.dim))
+        for name, meta in zip(store.names, store.meta):
+            print('{}\t{}'.format(name, json.dumps(meta)))
+        warn_bgr(store)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,74 @@
+import io
+import os
+import csv
+import sqlite3
+import datetime
+
+import pytest
+
+from events import parse_timestamp, parse_log_csv_row, import_logs, export_csv, main
+
+
+# Parsing of the apps' timestamps and the import of the repo's log.txt / log.csv, which
+# Main_Updated wrote the same events to (log.csv with the hour cut off).
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+LOG_TXT = os.path.join(HERE, 'log.txt')
+LOG_CSV = os.path.join(HERE, 'log.csv')
+
+
+def stored(db_path):
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute('SELECT person, ts, direction FROM events ORDER BY ts, person').fetchall()
+    conn.close()
+    return rows
+
+
+def test_parse_timestamp_formats():
+    expected = datetime.datetime(2025, 2, 22, 2, 52, 13, 488123)
+    assert parse_timestamp('2025-02-22 02:52:13.488123') == expected
+    assert parse_timestamp('2/22/2025', '02:52:13.488123') == expected
+    assert parse_timestamp('22 Feb 2025', '00:00') is None
+    assert parse_timestamp('2/22/2025', '41:51.5') is None  # No hour: only parsed with allow_partial
+
+
+def test_partial_time_is_flagged():
+    stamp, hour_known = parse_timestamp('2/22/2025', '41:51.5', allow_partial=True)
+    assert not hour_known
+    assert (stamp.date(), stamp.minute, stamp.second) == (datetime.date(2025, 2, 22), 41, 51)
+    assert parse_log_csv_row(['Name', 'Date', 'Timestamp', 'Action']) is None
+    assert parse_log_csv_row(['tk', '2/22/2025', '12:43:27', 'out'])[2]
+
+
+@pytest.mark.parametrize('paths', [[LOG_TXT, LOG_CSV], [LOG_CSV, LOG_TXT]])
+def test_import_both_logs_in_either_order(tmp_path, paths):
+    # Every log.csv row is a copy of a log.txt event, whatever order the files are given in
+    db_path = str(tmp_path / 'attendance.db')
+    assert import_logs(db_path, paths) == (26, 4, 0)
+    rows = stored(db_path)
+    assert len(rows) == 26
+    assert min(datetime.datetime.fromtimestamp(ts) for _, ts, _ in rows).hour == 2  # Nothing landed at hour 0
+
+    assert import_logs(db_path, paths) == (0, 30, 0)  # Importing again adds nothing
+    assert stored(db_path) == rows
+
+
+def test_hourless_rows_alone_are_not_guessed(tmp_path):
+    db_path = str(tmp_path / 'attendance.db')
+    assert import_logs(db_path, [LOG_CSV]) == (0, 0, 4)
+    assert stored(db_path) == []
+
+
+def test_export_to_includes_the_whole_day(tmp_path, capsys):
+    db_path = str(tmp_path / 'attendance.db')
+    import_logs(db_path, [LOG_TXT])
+    out = str(tmp_path / 'day.csv')
+    assert main(['--db', db_path, 'export', out, '--from', '2025-02-22', '--to', '2025-02-22']) == 0
+    with open(out, newline='') as f:
+        assert len(list(csv.reader(f))) == 1 + 26
+    assert main(['--db', db_path, 'export', out, '--to', '2025-02-21']) == 0
+    with open(out, newline='') as f:
+        assert len(list(csv.reader(f))) == 1
+
+    buffer = io.StringIO()
+    assert export_csv(db_path, buffer, person='john') == 4
@@ -0,0 +1,78 @@
+import os
+import datetime
+
+import numpy as np
+
+import events
+from reports import ColumnarCache
+
+
+# Session pairing on the repo's log.txt, and the incremental cache in front of it.
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+LOG_TXT = os.path.join(HERE, 'log.txt')
+
+
+def load(tmp_path, source=LOG_TXT):
+    return ColumnarCache(source, str(tmp_path / 'cache.npz')).load()
+
+
+def by_name(log, columns):
+    return [log.names[p] for p in columns['person']]
+
+
+def test_sessions_pair_each_in_with_the_next_out(tmp_path):
+    log = load(tmp_path)
+    assert len(log) == 26
+    sessions = log.sessions()
+    assert sorted(set(by_name(log, sessions))) == ['Michael', 'john', 'mike', 'tk']
+    assert by_name(log, sessions).count('mike') == 4  # The repeated 'out' at 03:01:44 pairs with nothing
+    assert np.all(sessions['duration'] > 0)
+    # tk's last visit: in 03:42:51.626887, out 03:43:27.041241
+    tk_last = np.argmax(np.where(np.array(by_name(log, sessions)) == 'tk', sessions['start'], -np.inf))
+    assert abs(sessions['duration'][tk_last] - 35.414354) < 1e-3
+
+
+def test_missing_checkouts(tmp_path):
+    log = load(tmp_path)
+    missing = log.missing_checkouts()
+    assert by_name(log, missing) == ['john', 'john', 'Michael']
+    clocks = [datetime.datetime.fromtimestamp(ts).strftime('%H:%M:%S') for ts in missing['ts']]
+    assert clocks == ['03:12:11', '03:12:29', '03:23:24']
+
+
+def test_daily_hours(tmp_path):
+    log = load(tmp_path)
+    daily = log.daily_hours()
+    sessions = log.sessions()
+    assert dict(zip(by_name(log, daily), daily['sessions'].tolist())) == {'mike': 4, 'john': 1, 'Michael': 3, 'tk': 3}
+    assert set(daily['day'].tolist()) == {datetime.date(2025, 2, 22).toordinal()}
+    np.testing.assert_allclose(daily['hours'].sum(), sessions['duration'].sum() / 3600.0)
+
+
+def test_cache_picks_up_appended_lines(tmp_path):
+    source = str(tmp_path / 'log.txt')
+    with open(LOG_TXT) as f:
+        lines = f.readlines()
+    with open(source, 'w') as f:
+        f.writelines(lines[:10])
+    assert len(load(tmp_path, source)) == 10
+    with open(source, 'a') as f:
+        f.writelines(lines[10:])
+    assert len(load(tmp_path, source)) == 26
+
+
+def test_cache_notices_a_recreated_database(tmp_path):
+    db_path = str(tmp_path / 'attendance.db')
+    events.import_logs(db_path, [LOG_TXT])
+    assert len(load(tmp_path, db_path)) == 26
+
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+    conn = events.connect(db_path)
+    with conn:
+        conn.execute(events.INSERT, ('ann', 2e9, 'in', '', None))
+    conn.close()
+    log = load(tmp_path, db_path)
+    assert log.names == ['ann'] and len(log) == 1
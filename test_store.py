@@ -0,0 +1,112 @@
+import os
+import pickle
+
+import numpy as np
+import pytest
+
+from store import VEC_FILE, IDX_FILE, JOURNAL_FILE, HEADER_SIZE, EmbeddingStore, open_store
+
+
+# Crash recovery of the packed store: most tests leave the files the way a crash at some point of
+# append_many would, then check what a fresh EmbeddingStore makes of them. The last ones cover several
+# writers on one directory and read-only opens of a legacy pickle directory.
+
+
+def rows(n, seed=0):
+    return np.random.default_rng(seed).normal(0, 0.1, (n, 128)).astype(np.float32)
+
+
+def filled_store(db_dir, n=3):
+    store = EmbeddingStore(str(db_dir))
+    store.append_many(['user{}'.format(i) for i in range(n)], rows(n), [{'i': i} for i in range(n)])
+    return store
+
+
+def test_reopen_after_append_many(tmp_path):
+    first = rows(3)
+    store = EmbeddingStore(str(tmp_path))
+    store.append_many(['a', 'b', 'c'], first, [{'i': 0}, {'i': 1}, {'i': 2}])
+    store.append('d', rows(1, seed=1))
+
+    reopened = EmbeddingStore(str(tmp_path))
+    assert len(reopened) == 4
+    assert reopened.names == ['a', 'b', 'c', 'd']
+    assert reopened.meta[1] == {'i': 1}
+    np.testing.assert_array_equal(reopened.embeddings[:3], first)
+    np.testing.assert_array_equal(reopened.embeddings[3], rows(1, seed=1)[0])
+    assert not os.path.exists(os.path.join(str(tmp_path), JOURNAL_FILE))
+
+
+def test_journal_replayed_over_torn_vec_tail(tmp_path):
+    # Crash after the journal was synced but halfway through writing the new rows
+    store = filled_store(tmp_path)
+    new = rows(2, seed=5)
+    store._write_journal(['x', 'y'], [{}, {}], new)
+    with open(os.path.join(str(tmp_path), VEC_FILE), 'r+b') as f:
+        f.seek(HEADER_SIZE + 3 * store.stride)
+        f.write(new.tobytes()[:store.stride + 100])
+
+    reopened = EmbeddingStore(str(tmp_path))
+    assert len(reopened) == 5
+    assert reopened.names[3:] == ['x', 'y']
+    np.testing.assert_array_equal(reopened.embeddings[3:], new)
+    assert not os.path.exists(os.path.join(str(tmp_path), JOURNAL_FILE))
+
+
+def test_torn_journal_is_dropped(tmp_path):
+    # Crash while the journal itself was being written: the append never happened
+    filled_store(tmp_path)
+    with open(os.path.join(str(tmp_path), JOURNAL_FILE), 'wb') as f:
+        f.write(b'{"row": 3, "names": ["x"')
+
+    reopened = EmbeddingStore(str(tmp_path))
+    assert len(reopened) == 3
+    assert not os.path.exists(os.path.join(str(tmp_path), JOURNAL_FILE))
+
+
+def test_trailing_garbage_without_journal_is_truncated(tmp_path):
+    store = filled_store(tmp_path)
+    expected = np.array(store.embeddings)
+    vec_size = os.path.getsize(os.path.join(str(tmp_path), VEC_FILE))
+    idx_size = os.path.getsize(os.path.join(str(tmp_path), IDX_FILE))
+    with open(os.path.join(str(tmp_path), VEC_FILE), 'ab') as f:
+        f.write(b'\x7f' * 300)
+    with open(os.path.join(str(tmp_path), IDX_FILE), 'ab') as f:
+        f.write(b'{"name": "half')
+
+    reopened = EmbeddingStore(str(tmp_path))
+    assert len(reopened) == 3
+    assert os.path.getsize(os.path.join(str(tmp_path), VEC_FILE)) == vec_size
+    assert os.path.getsize(os.path.join(str(tmp_path), IDX_FILE)) == idx_size
+    np.testing.assert_array_equal(reopened.embeddings, expected)
+
+    reopened.append('z', rows(1, seed=9))  # The next append lands right after the committed rows
+    again = EmbeddingStore(str(tmp_path))
+    assert again.names == ['user0', 'user1', 'user2', 'z']
+    np.testing.assert_array_equal(again.embeddings[3], rows(1, seed=9)[0])
+
+
+def test_two_writers_do_not_overwrite_each_other(tmp_path):
+    # Two processes with the store open (a kiosk and bulk_enroll): each append lands after the other's
+    EmbeddingStore(str(tmp_path)).append('alice', rows(1, seed=1))
+    a = EmbeddingStore(str(tmp_path))
+    b = EmbeddingStore(str(tmp_path))
+    b.append('bob', rows(1, seed=2))
+    a.append('carol', rows(1, seed=3))
+    assert a.names == ['alice', 'bob', 'carol']
+
+    reopened = EmbeddingStore(str(tmp_path))
+    assert reopened.names == ['alice', 'bob', 'carol']
+    for i, seed in enumerate((1, 2, 3)):
+        np.testing.assert_array_equal(reopened.embeddings[i], rows(1, seed=seed)[0])
+
+
+def test_read_only_open_leaves_legacy_directory_alone(tmp_path):
+    with open(os.path.join(str(tmp_path), 'ann.pickle'), 'wb') as f:
+        pickle.dump(rows(1)[0].astype(np.float64), f)
+    with pytest.raises(FileNotFoundError):
+        EmbeddingStore(str(tmp_path), create=False)
+    assert not EmbeddingStore.exists(str(tmp_path))
+
+    EmbeddingStore(str(tmp_path))  # Even an empty store left behind must not hide the pickles
+    assert open_store(str(tmp_path)).names == ['ann']
@@ -0,0 +1,262 @@
+import time
+import itertools
+from collections import namedtuple, deque
+
+import numpy as np
+import cv2
+
+
+# One attendance event produced by hands-free mode
+StreamEvent = namedtuple('StreamEvent', ['track_id', 'name', 'direction', 'distance', 'margin', 'timestamp'])
+
+
+def iou(a, b):
+    # Boxes are (top, right, bottom, left), the face_recognition convention
+    top, bottom = max(a[0], b[0]), min(a[2], b[2])
+    left, right = max(a[3], b[3]), min(a[1], b[1])
+    inter = max(0.0, bottom - top) * max(0.0, right - left)
+    area_a = (a[2] - a[0]) * (a[1] - a[3])
+    area_b = (b[2] - b[0]) * (b[1] - b[3])
+    return inter / float(area_a + area_b - inter) if inter > 0 else 0.0
+
+
+class Track:
+    def __init__(self, track_id, box, template):
+        self.track_id = track_id
+        self.box = box  # (top, right, bottom, left) in tracking (downscaled) coordinates
+        self.template = template  # Grayscale patch used to follow the face between detections
+        self.hits = 1  # Detections associated with this track
+        self.misses = 0  # Consecutive detections / tracking steps that lost the face
+        self.centers = deque(maxlen=8)  # Recent box centers, used to decide when the face is stable
+        self.centers.append(self.center)
+        self.state = 'tracking'  # tracking -> encoding -> done
+        self.attempts = 0  # Encoding attempts so far
+        self.encode_started = 0.0
+        self.name = None
+
+    @property
+    def center(self):
+        top, right, bottom, left = self.box
+        return (left + right) / 2.0, (top + bottom) / 2.0
+
+    @property
+    def size(self):
+        top, right, bottom, left = self.box
+        return right - left, bottom - top
+
+    def is_stable(self, min_hits, frames, max_shift):
+        if self.hits < min_hits or len(self.centers) < frames:
+            return False
+        recent = np.array(list(self.centers)[-frames:])
+        return float(np.ptp(recent, axis=0).max()) <= max_shift * max(self.size)
+
+
+class FaceTracker:
+    # Follows detected faces between detections with normalized template matching on a small gray frame
+    def __init__(self, min_score=0.5, iou_threshold=0.3, max_misses=3, search_margin=0.5):
+        self.min_score = min_score
+        self.iou_threshold = iou_threshold
+        self.max_misses = max_misses
+        self.search_margin = search_margin
+        self.tracks = []
+        self._ids = itertools.count(1)
+
+    @staticmethod
+    def _crop(gray, box):
+        top, right, bottom, left = [int(round(v)) for v in box]
+        h, w = gray.shape
+        top, left = max(0, top), max(0, left)
+        bottom, right = min(h, bottom), min(w, right)
+        if bottom - top < 4 or right - left < 4:
+            return None
+        return gray[top:bottom, left:right].copy()
+
+    def step(self, gray):
+        # Move every track to the best template match inside a window around its last position
+        h, w = gray.shape
+        for track in self.tracks:
+            th, tw = track.template.shape
+            top, right, bottom, left = track.box
+            mx, my = self.search_margin * tw, self.search_margin * th
+            y0, x0 = max(0, int(top - my)), max(0, int(left - mx))
+            y1, x1 = min(h, int(bottom + my) + 1), min(w, int(right + mx) + 1)
+            if y1 - y0 < th or x1 - x0 < tw:
+                track.misses += 1
+                continue
+
+            scores = cv2.matchTemplate(gray[y0:y1, x0:x1], track.template, cv2.TM_CCOEFF_NORMED)
+            _, score, _, (dx, dy) = cv2.minMaxLoc(scores)
+            if score < self.min_score:
+                track.misses += 1
+                continue
+
+            track.box = (y0 + dy, x0 + dx + tw, y0 + dy + th, x0 + dx)
+            track.centers.append(track.center)
+            track.misses = 0
+        self._prune()
+
+    def correct(self, detections, gray):
+        # Associate fresh detections (tracking coordinates) with tracks greedily by IoU
+        unmatched = list(range(len(detections)))
+        for track in sorted(self.tracks, key=lambda t: -t.hits):
+            if not unmatched:
+                track.misses += 1
+                continue
+            best = max(unmatched, key=lambda i: iou(track.box, detections[i]))
+            if iou(track.box, detections[best]) < self.iou_threshold:
+                track.misses += 1
+                continue
+            unmatched.remove(best)
+            template = self._crop(gray, detections[best])
+            track.box = detections[best]
+            if template is not None:
+                track.template = template  # Refresh the template on every detection to limit drift
+            track.hits += 1
+            track.misses = 0
+            track.centers.append(track.center)
+
+        for i in unmatched:
+            template = self._crop(gray, detections[i])
+            if template is not None:
+                self.tracks.append(Track(next(self._ids), detections[i], template))
+        self._prune()
+
+    def _prune(self):
+        self.tracks = [t for t in self.tracks if t.misses <= self.max_misses]
+
+
+class AttendanceStream:
+    # Hands-free mode: detect every N frames or on motion, track in between, and encode each
+    # track once it is stable. Runs on the Tk thread; detection/encoding go to a RecognitionExecutor.
+    def __init__(self, feed, executor, on_event, direction='in', detect_every=30, motion_threshold=0.01,
+                 min_detect_gap=5, track_width=320, min_hits=2, stable_frames=5, max_shift=0.15,
+                 max_attempts=2, cooldown=60.0, request_timeout=5.0, key_prefix='stream'):
+        self.feed = feed  # FrameConsumer of its own, independent of the preview
+        self.executor = executor
+        self.key_prefix = key_prefix  # Executor keys are '<prefix>-detect' / '<prefix>-encode-<id>'; unique per stream
+        self.on_event = on_event
+        self.direction = direction
+        self.detect_every = detect_every
+        self.motion_threshold = motion_threshold
+        self.min_detect_gap = min_detect_gap
+        self.track_width = track_width
+        self.min_hits = min_hits
+        self.stable_frames = stable_frames
+        self.max_shift = max_shift
+        self.max_attempts = max_attempts
+        self.cooldown = cooldown
+        self.request_timeout = request_timeout  # Resubmit if the executor dropped a request
+
+        self.tracker = FaceTracker()
+        self._prev_gray = None
+        self._frames_since_detect = detect_every  # Detect on the first frame
+        self._detect_submitted = None  # Time of the detection request in flight, if any
+        self._last_seen = {}  # name -> time of its last event, for the cooldown
+
+        # Counters
+        self.frames = 0
+        self.detections = 0
+        self.encodings = 0
+        self.events = 0
+        self.skipped = 0  # Detections/encodings postponed because the caller had no capacity for them
+
+    def _small_gray(self, frame):
+        h, w = frame.shape[:2]
+        scale = min(1.0, self.track_width / float(w))
+        small = cv2.resize(frame, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA) if scale < 1.0 else frame
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), scale
+
+    def _motion(self, gray):
+        if self._prev_gray is None or self._prev_gray.shape != gray.shape:
+            return 1.0
+        diff = cv2.absdiff(gray, self._prev_gray)
+        return float(np.count_nonzero(diff > 25)) / diff.size
+
+    def tick(self, budget=None):
+        # Call periodically (e.g. from after()); cheap when nothing is in front of the camera.
+        # budget caps the requests this tick may submit (None: no cap); detections and encodings over
+        # the budget wait for a later tick while the frame is still tracked. Returns the number submitted.
+        frame = self.feed.read(timeout=0)
+        if frame is None:
+            return 0
+        self.frames += 1
+        image = frame.image
+        gray, scale = self._small_gray(image)
+        motion = self._motion(gray)
+        self._prev_gray = gray
+
+        self.tracker.step(gray)
+        self._frames_since_detect += 1
+
+        due = self._frames_since_detect >= self.detect_every
+        moved = motion >= self.motion_threshold and self._frames_since_detect >= self.min_detect_gap
+        now = time.monotonic()
+        in_flight = self._detect_submitted is not None and now - self._detect_submitted < self.request_timeout
+        # Encodings first: they are what produces events, detections only keep the tracks honest
+        submitted = 0
+        for track in self.tracker.tracks:
+            if track.state == 'encoding' and now - track.encode_started > self.request_timeout:
+                track.state = 'tracking'  # The request was dropped, try again
+            if track.state == 'tracking' and track.is_stable(self.min_hits, self.stable_frames, self.max_shift):
+                if budget is None or submitted < budget:
+                    self._encode(track, image, scale)
+                    submitted += 1
+                else:
+                    self.skipped += 1
+
+        if (due or moved) and not in_flight:
+            if budget is None or submitted < budget:
+                self._frames_since_detect = 0
+                self._detect_submitted = now
+                self.detections += 1
+                submitted += 1
+                self.executor.submit(image, key=self.key_prefix + '-detect', context={'gray': gray, 'scale': scale},
+                                     encode=False)
+            else:
+                self.skipped += 1
+        return submitted
+
+    def _encode(self, track, image, scale):
+        h, w = image.shape[:2]
+        top, right, bottom, left = track.box
+        box = (max(0, int(top / scale)), min(w, int(right / scale)), min(h, int(bottom / scale)), max(0, int(left / scale)))
+        track.state = 'encoding'
+        track.encode_started = time.monotonic()
+        track.attempts += 1
+        self.encodings += 1
+        self.executor.submit(image, key='{}-encode-{}'.format(self.key_prefix, track.track_id),
+                             context={'track_id': track.track_id}, locations=[box])
+
+    def on_result(self, result):
+        # Route executor results whose key starts with '<key_prefix>-'
+        if result.key == self.key_prefix + '-detect':
+            self._detect_submitted = None
+            if result.error is not None:
+                return
+            scale = result.context['scale']
+            detections = [tuple(v * scale for v in box) for box in result.locations]
+            self.tracker.correct(detections, result.context['gray'])
+            return
+
+        track = next((t for t in self.tracker.tracks if t.track_id == result.context['track_id']), None)
+        if track is None:
+            return  # The face left before its encoding came back
+        if result.error is not None or not result.matches or result.matches[0].name == 'unknown_person':
+            track.state = 'tracking' if track.attempts < self.max_attempts else 'done'
+            return
+
+        match = result.matches[0]
+        track.state = 'done'  # Each track is recognized once
+        track.name = match.name
+        now = time.time()
+        if now - self._last_seen.get(match.name, 0.0) < self.cooldown:
+            return
+        self._last_seen[match.name] = now
+        self.events += 1
+        self.on_event(StreamEvent(track.track_id, match.name, self.direction, match.distance, match.margin, now))
+
+    def reset(self):
+        self.tracker = FaceTracker()
+        self._prev_gray = None
+        self._frames_since_detect = self.detect_every
+        self._detect_submitted = None
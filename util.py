@@ -1,12 +1,9 @@
-import os
-import pickle
-
-import tkinter as tk
-from tkinter import messagebox
-import face_recognition
+# tkinter, the detection pipeline (face_recognition/dlib) and the gallery are imported inside the
+# functions that use them, so importing util for one helper does not pay for all of them
 
 
 def get_button(window, text, color, command, fg='white'):
+    import tkinter as tk
     button = tk.Button(
                         window,
                         text=text,
@@ -24,18 +21,21 @@ def get_button(window, text, color, command, fg='white'):
 
 
 def get_img_label(window):
+    import tkinter as tk
     label = tk.Label(window)
     label.grid(row=0, column=0)
     return label
 
 
 def get_text_label(window, text):
+    import tkinter as tk
     label = tk.Label(window, text=text)
     label.config(font=("sans-serif", 21), justify="left")
     return label
 
 
 def get_entry_text(window):
+    import tkinter as tk
     inputtxt = tk.Text(window,
                        height=2,
                        width=15, font=("Arial", 32))
@@ -43,32 +43,26 @@ def get_entry_text(window):
 
 
 def msg_box(title, description):
+    from tkinter import messagebox
     messagebox.showinfo(title, description)
 
 
-def recognize(img, db_path):
-    # it is assumed there will be at most 1 match in the db
-
-    embeddings_unknown = face_recognition.face_encodings(img)
-    if len(embeddings_unknown) == 0:
-        return 'no_persons_found'
-    else:
-        embeddings_unknown = embeddings_unknown[0]
-
-    db_dir = sorted(os.listdir(db_path))
-
-    match = False
-    j = 0
-    while not match and j < len(db_dir):
-        path_ = os.path.join(db_path, db_dir[j])
+def recognize(img, db_path, gallery=None, profile='full'):
+    # returns the nearest enrolled name, or 'unknown_person' if it is farther than the tolerance
+    # img is a BGR camera frame; profile selects the detection settings (see detection.PROFILES)
+    import detection
+    import metrics
+    from gallery import Gallery
 
-        file = open(path_, 'rb')
-        embeddings = pickle.load(file)
+    with metrics.timer('recognize'):
+        rgb = detection.to_rgb(img)
+        boxes = detection.detect(rgb, profile)
+        if len(boxes) == 0:
+            metrics.inc('no_face')
+            return 'no_persons_found'
+        embeddings_unknown = detection.encode(rgb, boxes[:1])[0]
 
-        match = face_recognition.compare_faces([embeddings], embeddings_unknown)[0]
-        j += 1
+        if gallery is None:
+            gallery = Gallery.from_dir(db_path)
 
-    if match:
-        return db_dir[j - 1][:-7]
-    else:
-        return 'unknown_person'
\ No newline at end of file
+        return gallery.match(embeddings_unknown).name
@@ -0,0 +1,236 @@
+import time
+import queue
+import threading
+import itertools
+import multiprocessing
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import numpy as np
+import cv2
+
+import metrics
+
+
+# Outcome of one request, handed back to the Tk thread by RecognitionExecutor.poll()
+Result = namedtuple('Result', ['request_id', 'key', 'context', 'locations', 'matches', 'latency', 'error', 'encodings'])
+
+_detection = None  # Set once per worker process by _init_worker
+_options = {}
+
+
+def _init_worker(profile):
+    # Runs once in every worker process: importing face_recognition loads the dlib models
+    global _detection
+    import detection
+    detection.load()
+    _detection = detection
+    _options.update(profile=detection.get_profile(profile))
+
+
+def _ready():
+    return True
+
+
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # Python 3.13+: the parent owns the block
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+def _detect_and_encode(shm_name, shape, dtype, locations=None, encode=True):
+    # Worker side: read the RGB frame straight out of shared memory, return only the small results.
+    # Known locations skip detection; encode=False skips encoding.
+    # Stage timings come back with the result: metrics recorded inside a worker process would never be seen.
+    timings = {}
+    shm = _attach(shm_name)
+    try:
+        rgb = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        if locations is None:
+            start = time.perf_counter()
+            locations = _detection.detect(rgb, _options['profile'])  # Downscaled detection, full-res boxes
+            timings['face_locations'] = time.perf_counter() - start
+        encodings = []
+        if encode and locations:
+            start = time.perf_counter()
+            encodings = _detection.encode(rgb, locations)
+            timings['face_encodings'] = time.perf_counter() - start
+        del rgb  # Drop the view before closing the mapping
+    finally:
+        shm.close()
+    return locations, np.asarray(encodings, dtype=np.float32).reshape(-1, 128), timings
+
+
+class _Request:
+    def __init__(self, request_id, key, context, block, submitted, deliver, encode):
+        self.request_id = request_id
+        self.key = key
+        self.context = context
+        self.encode = encode
+        self.block = block
+        self.submitted = submitted
+        self.deliver = deliver  # False for run(): the caller waits on the future itself
+        self.future = None
+        self.cancelled = False
+
+
+class RecognitionExecutor:
+    # Runs face detection + encoding in a process pool so the Tk thread never blocks.
+    # Frames travel through shared memory; only boxes and 128-d encodings come back.
+    # Matching against the gallery happens in poll(), on the caller's thread.
+    def __init__(self, gallery, workers=2, max_pending=4, profile='balanced'):
+        self.gallery = gallery
+        self.workers = workers
+        self.max_pending = max_pending
+        self.profile = profile  # Detection profile name or detection.DetectionProfile
+
+        self._lock = threading.RLock()  # Re-entrant: cancelling a queued future runs _on_done inline
+        self._ids = itertools.count(1)
+        self._pending = {}  # request_id -> _Request, in submission order
+        self._done = queue.Queue()
+        self._free_blocks = []  # Shared memory blocks ready for reuse
+        self._all_blocks = []
+        self._pool = self._new_pool()
+
+        self.cancelled = 0  # Requests dropped because a newer one superseded them or the queue was full
+
+    def _new_pool(self):
+        # spawn: forking a process that runs Tk and a capture thread is not safe
+        return ProcessPoolExecutor(max_workers=self.workers,
+                                   mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=_init_worker,
+                                   initargs=(self.profile,))
+
+    def _acquire_block(self, nbytes):
+        for i, block in enumerate(self._free_blocks):
+            if block.size >= nbytes:
+                return self._free_blocks.pop(i)
+        block = shared_memory.SharedMemory(create=True, size=nbytes)
+        self._all_blocks.append(block)
+        return block
+
+    def _release_block(self, block):
+        self._free_blocks.append(block)
+
+    def warm_up(self, timeout=None):
+        # Start every worker process now (each loads the dlib models in _init_worker) instead of on the
+        # first request. Blocks until they are up; call it from a background thread at startup.
+        futures = [self._pool.submit(_ready) for _ in range(self.workers)]
+        for future in futures:
+            future.result(timeout)
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    def pending_keys(self):
+        with self._lock:
+            return [request.key for request in self._pending.values()]
+
+    def submit(self, frame, key='default', context=None, locations=None, encode=True):
+        # frame is a BGR image; any older request with the same key is cancelled as superseded.
+        # Pass locations to only encode known boxes, or encode=False to only detect.
+        with self._lock:
+            for request in list(self._pending.values()):
+                if request.key == key:
+                    self._cancel(request)
+            while len(self._pending) >= self.max_pending:
+                self._cancel(next(iter(self._pending.values())))
+            request = self._start(frame, key, context, locations, encode)
+        return request.request_id
+
+    def run(self, frame, locations=None, encode=True, timeout=None):
+        # Blocking variant for threads other than Tk (e.g. the HTTP server): returns (locations, encodings).
+        # Never superseded and never delivered through poll().
+        request = self._start(frame, None, None, locations, encode, deliver=False)
+        locations, encodings, _ = request.future.result(timeout)
+        return locations, encodings
+
+    def _start(self, frame, key, context, locations, encode, deliver=True):
+        with self._lock:
+            block = self._acquire_block(frame.nbytes)
+            request = _Request(next(self._ids), key, context, block, time.monotonic(), deliver, encode)
+            rgb = np.ndarray(frame.shape, dtype=frame.dtype, buffer=block.buf)
+            with metrics.timer('cvtColor'):
+                cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=rgb)  # Convert straight into shared memory
+            del rgb
+            if deliver:
+                self._pending[request.request_id] = request
+            metrics.gauge('recognition_pending', len(self._pending))
+
+        args = (block.name, frame.shape, frame.dtype.str, locations, encode)
+        try:
+            request.future = self._pool.submit(_detect_and_encode, *args)
+        except BrokenProcessPool:
+            self._pool = self._new_pool()  # A worker died: start a fresh pool and retry once
+            request.future = self._pool.submit(_detect_and_encode, *args)
+        request.future.add_done_callback(lambda future, request=request: self._on_done(request))
+        return request
+
+    def _cancel(self, request):
+        # Queued work is cancelled outright; work already running finishes and its result is dropped
+        request.cancelled = True
+        self.cancelled += 1
+        metrics.inc('recognition_cancelled')
+        self._pending.pop(request.request_id, None)
+        if request.future is not None:
+            request.future.cancel()
+
+    def cancel(self, key):
+        with self._lock:
+            for request in list(self._pending.values()):
+                if request.key == key:
+                    self._cancel(request)
+
+    def _on_done(self, request):
+        # Runs on the pool's management thread once the worker is finished with the block
+        with self._lock:
+            self._pending.pop(request.request_id, None)
+            self._release_block(request.block)
+            metrics.gauge('recognition_pending', len(self._pending))
+        if not request.future.cancelled() and request.future.exception() is None:
+            for stage, seconds in request.future.result()[2].items():
+                metrics.observe(stage, seconds)
+        if request.cancelled or request.future.cancelled() or not request.deliver:
+            return
+        self._done.put(request)
+
+    def poll(self):
+        # Call from the Tk thread (e.g. via after()): returns the finished, non-superseded results
+        results = []
+        while True:
+            try:
+                request = self._done.get_nowait()
+            except queue.Empty:
+                return results
+            if request.cancelled:
+                continue
+
+            latency = time.monotonic() - request.submitted
+            metrics.observe('recognition_latency', latency)
+            error = request.future.exception()
+            if error is not None:
+                metrics.inc('recognition_errors')
+                results.append(Result(request.request_id, request.key, request.context, [], [], latency, error, None))
+                continue
+
+            locations, encodings, _ = request.future.result()
+            if request.encode and not locations:
+                metrics.inc('no_face')
+            matches = self.gallery.match_many(encodings)  # One vectorized lookup for every face
+            results.append(Result(request.request_id, request.key, request.context, locations, matches, latency, None,
+                                  encodings))
+
+    def shutdown(self):
+        with self._lock:
+            for request in list(self._pending.values()):
+                self._cancel(request)
+        self._pool.shutdown(wait=True)
+        for block in self._all_blocks:
+            block.close()
+            block.unlink()
+        self._all_blocks = []
+        self._free_blocks = []